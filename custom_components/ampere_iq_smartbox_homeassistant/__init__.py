@@ -3,34 +3,65 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from datetime import datetime
 import logging
+from pathlib import Path
+import time
 from typing import TYPE_CHECKING, Any
 
 import aiohttp
 from yarl import URL
 
-from homeassistant.components.sensor import (
-    SensorDeviceClass,
-    SensorEntity,
-    SensorStateClass,
-)
-from homeassistant.config_entries import ConfigEntry
+from homeassistant.config_entries import ConfigEntry, ConfigEntryState
 from homeassistant.const import CONF_PASSWORD, CONF_URL, Platform
 from homeassistant.core import HomeAssistant
 
 # import aiohttp_socks
-from homeassistant.helpers import aiohttp_client
+from homeassistant.helpers import (
+    aiohttp_client,
+    config_validation as cv,
+    entity_registry as er,
+)
 from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.typing import ConfigType
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, timedelta
 
-from .kiwi_os_api import KiwiOsApi, KiwiOsApiItems
+from .const import (
+    CONF_ALIGN_POLLS,
+    CONF_CAPTURE,
+    CONF_CHANNEL_POLICY,
+    CONF_CLOUD_TAGS,
+    CONF_EXPORT,
+    CONF_MAX_CONCURRENT_REQUESTS,
+    CONF_MAX_REQUEST_RATE,
+    CONF_TIMESTAMP_MODE,
+    DOMAIN,
+    TIMESTAMP_MODE_ENTITY,
+)
+from .kiwi_os_api import (
+    KiwiOsApi,
+    KiwiOsApiItems,
+    KiwiOsCommandQueue,
+    PasswordInvalidException,
+    PasswordRequiredException,
+)
+from .kiwi_os_budget import BUDGET_MAX_CONCURRENCY, BUDGET_MAX_RATE
+from .kiwi_os_capture import KiwiOsCapture
+from .kiwi_os_core import CHANNEL_POLICY_ALL, CHANNEL_POLICY_DEFAULT
+from .kiwi_os_export import KiwiOsColumnarExporter
+from .kiwi_os_feed import KiwiOsSnapshotFeed
+from .kiwi_os_freshness import KiwiOsFreshnessTracker
+from .kiwi_os_memory import KiwiOsMemoryProfiler
 from .kiwi_os_parser import KiwiOsParser
+from .kiwi_os_schedule import KiwiOsPollAligner
+from .services import async_setup_services
+from .websocket_api import async_setup_websocket_api
 
 if TYPE_CHECKING:
     from .sensor import (
         KiwiOsDataUpdateCoordinator,
         KiwiOsSensorEntity,
-        KiwiOsTimestampSensorEntity,
     )
 
 # from kiwi_os_api import KiwiOsApi, KiwiOsApiItems
@@ -47,8 +78,11 @@ _PLATFORMS: list[Platform] = [
 ]
 _LOGGER = logging.getLogger(__name__)
 UPDATE_INTERVAL = 60  # seconds
+THING_STATUS_INTERVAL = 5 * 60  # seconds
 REQUEST_REFRESH_DELAY = 0.5
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
 type KiwiOsConfigEntry = ConfigEntry[KiwiOsData]
 type KiwiOsDataUpdateCoordinator = DataUpdateCoordinator[KiwiOsApiItems]
 
@@ -60,6 +94,19 @@ class KiwiOsData:
     coordinator: KiwiOsDataUpdateCoordinator
     api: KiwiOsApi
     parser: KiwiOsParser
+    commands: KiwiOsCommandQueue
+    freshness: KiwiOsFreshnessTracker
+    exporter: KiwiOsColumnarExporter | None
+    feed: KiwiOsSnapshotFeed
+    memory: KiwiOsMemoryProfiler
+    options: dict[str, Any]
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the integration."""
+    async_setup_services(hass)
+    async_setup_websocket_api(hass)
+    return True
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bool:
@@ -84,11 +131,52 @@ async def async_setup_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bo
     #     ),
     # )
 
+    aligner: KiwiOsPollAligner | None = None
+    if entry.options.get(CONF_ALIGN_POLLS, True):
+        aligner = KiwiOsPollAligner(interval=UPDATE_INTERVAL)
+
+    freshness = KiwiOsFreshnessTracker()
+    feed = KiwiOsSnapshotFeed()
+    memory = KiwiOsMemoryProfiler()
+    entry.async_on_unload(feed.close)
+
+    exporter: KiwiOsColumnarExporter | None = None
+    if entry.options.get(CONF_EXPORT, False):
+        exporter = KiwiOsColumnarExporter(
+            Path(hass.config.path(DOMAIN, "export", entry.entry_id)),
+            hass.async_add_executor_job,
+        )
+
     async def async_update_data() -> None:
-        print("async_update_data")
-        json_items: Any = await api.get_items()
-        items: KiwiOsApiItems = parser.map_json_items(json_items)
-        parser.parse_item_values(items)
+        try:
+            json_items: Any = await api.get_items()
+        except Exception:
+            # Retry at the normal interval, not at the short delay the aligner
+            # may have chosen for the next update of a box that answered.
+            coordinator.update_interval = timedelta(seconds=UPDATE_INTERVAL)
+            raise
+        fetched_at = time.time()
+        with memory.measure_poll():
+            items: KiwiOsApiItems = parser.map_json_items(json_items)
+            parser.parse_item_values(items)
+            # The entities write their state right after this update returns.
+            freshness.record(parser.item_timestamps_ms, time.time())
+
+            feed.publish(fetched_at, parser.iter_values())
+
+            if exporter is not None:
+                exporter.append(fetched_at, parser.iter_values())
+                if exporter.flush_due():
+                    entry.async_create_background_task(
+                        hass, exporter.async_flush(), "ampereiq export"
+                    )
+
+        if aligner is not None:
+            aligner.observe(parser.item_timestamps_ms.values(), fetched_at)
+            delay = aligner.next_delay(time.time())
+            coordinator.update_interval = timedelta(
+                seconds=delay if delay is not None else UPDATE_INTERVAL
+            )
 
     coordinator: KiwiOsDataUpdateCoordinator = DataUpdateCoordinator[Any](
         hass,
@@ -107,15 +195,33 @@ async def async_setup_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bo
         new_data["kiwisessionid"] = api.get_kiwisessionid()
         hass.config_entries.async_update_entry(entry, data=new_data)
 
+    capture: KiwiOsCapture | None = None
+    if entry.options.get(CONF_CAPTURE, False):
+        capture = KiwiOsCapture(
+            Path(hass.config.path(DOMAIN, f"{entry.entry_id}.capture.jsonl.gz"))
+        )
+
     api: KiwiOsApi = KiwiOsApi(
         url=url,
         session=session,
         password=password,
         kiwisessionid=kiwisessionid,
         kiwisessionid_changed_callback=update_kiwisessionid,
+        capture=capture,
+    )
+    api.budget.configure(
+        max_rate=entry.options.get(CONF_MAX_REQUEST_RATE, BUDGET_MAX_RATE),
+        max_concurrency=entry.options.get(
+            CONF_MAX_CONCURRENT_REQUESTS, BUDGET_MAX_CONCURRENCY
+        ),
     )
 
-    parser: KiwiOsParser = KiwiOsParser()
+    cloud_tags: str = entry.options.get(CONF_CLOUD_TAGS, "")
+    parser: KiwiOsParser = KiwiOsParser(
+        timestamp_mode=entry.options.get(CONF_TIMESTAMP_MODE, TIMESTAMP_MODE_ENTITY),
+        channel_policy=entry.options.get(CONF_CHANNEL_POLICY, CHANNEL_POLICY_DEFAULT),
+        cloud_tags={tag.strip() for tag in cloud_tags.split(",") if tag.strip()},
+    )
     json_things: Any = await api.get_things()
     json_items: Any = await api.get_items()
     items: KiwiOsApiItems = parser.map_json_items(json_items)
@@ -131,15 +237,102 @@ async def async_setup_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bo
         _LOGGER.error("Failed to fetch initial data from AmpereIQ")
         return False
 
-    entry.runtime_data = KiwiOsData(coordinator=coordinator, api=api, parser=parser)
+    def command_acknowledged(item: Any) -> None:
+        if parser.parse_item_update(item):
+            coordinator.async_update_listeners()
+
+    commands = KiwiOsCommandQueue(api, acknowledged_callback=command_acknowledged)
+    entry.async_on_unload(commands.close)
+
+    async def async_check_things(now: datetime) -> None:
+        try:
+            json_things: Any = await api.get_thing_summaries()
+        except (
+            aiohttp.ClientError,
+            TimeoutError,
+            PasswordInvalidException,
+            PasswordRequiredException,
+        ) as error:
+            _LOGGER.debug("Cannot check the status of the things: %s", error)
+            return
+        if parser.update_thing_statuses(json_things):
+            feed.mark_unavailable(parser.get_offline_item_names())
+            coordinator.async_update_listeners()
+
+    entry.async_on_unload(
+        async_track_time_interval(
+            hass,
+            async_check_things,
+            timedelta(seconds=THING_STATUS_INTERVAL),
+            cancel_on_shutdown=True,
+        )
+    )
+
+    entry.runtime_data = KiwiOsData(
+        coordinator=coordinator,
+        api=api,
+        parser=parser,
+        commands=commands,
+        freshness=freshness,
+        exporter=exporter,
+        feed=feed,
+        memory=memory,
+        options=dict(entry.options),
+    )
 
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
     await hass.config_entries.async_forward_entry_setups(entry, _PLATFORMS)
 
     return True
 
 
+async def async_migrate_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bool:
+    """Migrate a config entry to the current version."""
+    if entry.version > 1:
+        # Downgraded from a future version.
+        return False
+
+    if entry.minor_version < 2:
+        # Entries from before the channel policy option keep all channels,
+        # only new entries default to the cloud mapped ones.
+        hass.config_entries.async_update_entry(
+            entry,
+            options={CONF_CHANNEL_POLICY: CHANNEL_POLICY_ALL, **entry.options},
+            minor_version=2,
+        )
+    return True
+
+
+async def async_reload_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> None:
+    """Reload a config entry after its options changed.
+
+    Entities the new options deselect are removed from the entity registry.
+    Other entities that are not created again, e.g. timestamp sensors of items
+    that are UNDEF right now, are left for the user to remove.
+    """
+    if entry.options == entry.runtime_data.options:
+        # Only the data changed, e.g. the session id after a new login.
+        return
+    old_parser = entry.runtime_data.parser
+    await hass.config_entries.async_reload(entry.entry_id)
+    if entry.state is not ConfigEntryState.LOADED:
+        return
+
+    entity_registry = er.async_get(hass)
+    for unique_id in old_parser.deselected_unique_ids(entry.runtime_data.parser):
+        entity_id = entity_registry.async_get_entity_id(
+            Platform.SENSOR, DOMAIN, unique_id
+        )
+        if entity_id is not None:
+            entity_registry.async_remove(entity_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: KiwiOsConfigEntry) -> bool:
     """Unload a config entry."""
     # api = entry.runtime_data.api
     # await api.close()
-    return await hass.config_entries.async_unload_platforms(entry, _PLATFORMS)
+    unload_ok = await hass.config_entries.async_unload_platforms(entry, _PLATFORMS)
+    exporter = entry.runtime_data.exporter
+    if unload_ok and exporter is not None:
+        await exporter.async_flush()
+    return unload_ok
@@ -10,11 +10,31 @@ import voluptuous as vol
 from yarl import URL
 
 from homeassistant import config_entries
-from homeassistant.const import CONF_PASSWORD, CONF_URL
+from homeassistant.const import CONF_HOSTS, CONF_PASSWORD, CONF_URL
+from homeassistant.core import callback
 from homeassistant.helpers import aiohttp_client
 
-from .const import DOMAIN
+from .const import (
+    CONF_ALIGN_POLLS,
+    CONF_CAPTURE,
+    CONF_CHANNEL_POLICY,
+    CONF_CLOUD_TAGS,
+    CONF_EXPORT,
+    CONF_MAX_CONCURRENT_REQUESTS,
+    CONF_MAX_REQUEST_RATE,
+    CONF_TIMESTAMP_MODE,
+    DOMAIN,
+    TIMESTAMP_MODE_ENTITY,
+    TIMESTAMP_MODES,
+)
 from .kiwi_os_api import KiwiOsApi, PasswordInvalidException, PasswordRequiredException
+from .kiwi_os_budget import BUDGET_MAX_CONCURRENCY, BUDGET_MAX_RATE
+from .kiwi_os_core import (
+    CHANNEL_POLICIES,
+    CHANNEL_POLICY_CLOUD_MAPPED,
+    CHANNEL_POLICY_DEFAULT,
+)
+from .kiwi_os_discovery import async_discover, expand_hosts
 
 # import aiohttp_socks
 
@@ -25,14 +45,88 @@ DATA_SCHEMA = vol.Schema(
     }
 )
 
+SCAN_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_HOSTS): str,
+    }
+)
+
+OPTIONS_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_CHANNEL_POLICY, default=CHANNEL_POLICY_DEFAULT): vol.In(
+            CHANNEL_POLICIES
+        ),
+        vol.Optional(CONF_CLOUD_TAGS, default=""): str,
+        vol.Optional(CONF_TIMESTAMP_MODE, default=TIMESTAMP_MODE_ENTITY): vol.In(
+            TIMESTAMP_MODES
+        ),
+        vol.Optional(CONF_ALIGN_POLLS, default=True): bool,
+        vol.Optional(CONF_MAX_REQUEST_RATE, default=BUDGET_MAX_RATE): vol.All(
+            vol.Coerce(float), vol.Range(min=0.1, max=20)
+        ),
+        vol.Optional(
+            CONF_MAX_CONCURRENT_REQUESTS, default=BUDGET_MAX_CONCURRENCY
+        ): vol.All(vol.Coerce(int), vol.Range(min=1, max=8)),
+        vol.Optional(CONF_EXPORT, default=False): bool,
+        vol.Optional(CONF_CAPTURE, default=False): bool,
+    }
+)
+
 
 class AmpereConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Config flow for Ampere PV integration."""
 
     VERSION = 1
+    # 1.2: New entries only create entities for cloud mapped channels.
+    MINOR_VERSION = 2
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Create the options flow."""
+        return AmpereOptionsFlow()
+
+    def __init__(self) -> None:
+        """Initialize the config flow."""
+        self._discovered_urls: list[str] = []
+        self._session: aiohttp.ClientSession | None = None
+
+    @callback
+    def async_remove(self) -> None:
+        """Close the session of the flow."""
+        if self._session is not None:
+            self.hass.async_create_background_task(
+                self._session.close(), "ampereiq config flow session close"
+            )
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the session used to validate all attempts of this flow.
+
+        The flow has its own session, because the login cookie of a box must
+        not end up in the session shared by Home Assistant.
+        """
+        if self._session is None:
+            self._session = aiohttp_client.async_create_clientsession(
+                self.hass,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(
+                    total=60, connect=30, sock_connect=10, sock_read=30
+                ),
+                auto_cleanup=False,
+            )
+        return self._session
 
     async def async_step_user(self, user_input=None) -> config_entries.ConfigFlowResult:
-        """Handle the user step in the configuration flow.
+        """Let the user choose between entering a URL and scanning the network."""
+        return self.async_show_menu(step_id="user", menu_options=["manual", "scan"])
+
+    async def async_step_manual(
+        self, user_input=None
+    ) -> config_entries.ConfigFlowResult:
+        """Handle the manual step in the configuration flow.
 
         Parameters
         ----------
@@ -44,71 +138,134 @@ class AmpereConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         dict
             The result of the configuration step.
         """
-        errors = {}
-        description_placeholders = {}
         if user_input is not None:
-            # session = aiohttp.ClientSession(
-            #     connector=aiohttp_socks.ProxyConnector.from_url(
-            #         "socks5://192.168.178.62:8889"
-            #     ),
-            #     cookie_jar=aiohttp.CookieJar(unsafe=True),
-            #     timeout=aiohttp.ClientTimeout(
-            #         total=60, connect=30, sock_connect=10, sock_read=30
-            #     ),
-            # )
-            session = aiohttp_client.async_create_clientsession(
-                self.hass,
-                cookie_jar=aiohttp.CookieJar(unsafe=True),
-                timeout=aiohttp.ClientTimeout(
-                    total=60, connect=30, sock_connect=10, sock_read=30
-                ),
-                auto_cleanup=False,
+            return await self._async_create_entry_or_show_form(
+                "manual", DATA_SCHEMA, user_input
             )
+
+        return self.async_show_form(step_id="manual", data_schema=DATA_SCHEMA)
+
+    async def async_step_scan(self, user_input=None) -> config_entries.ConfigFlowResult:
+        """Scan a subnet or a list of hosts for SmartBoxes."""
+        errors = {}
+        if user_input is not None:
             try:
-                url_str = user_input[CONF_URL].rstrip("/")
-                if "://" not in url_str:
-                    url_str = "http://" + url_str
-                url = URL(url_str)
-                password = user_input.get(CONF_PASSWORD, "")
-
-                api = KiwiOsApi(
-                    url=url,
-                    session=session,
-                    password=password,
-                )
-                if password:
-                    await api.login()
-                await api.get_rest()
-
-                return self.async_create_entry(
-                    title=str(url),
-                    data={
-                        CONF_URL: str(url),
-                        CONF_PASSWORD: password,
-                        "kiwisessionid": api.get_kiwisessionid(),
-                    },
+                hosts = expand_hosts(user_input[CONF_HOSTS])
+            except ValueError:
+                errors[CONF_HOSTS] = "invalid_hosts"
+            else:
+                configured_urls = {
+                    entry.data[CONF_URL] for entry in self._async_current_entries()
+                } | self._async_current_ids()
+                found = await async_discover(
+                    aiohttp_client.async_get_clientsession(self.hass), hosts
                 )
-            except PasswordRequiredException:
-                errors["password"] = "required"
-            except PasswordInvalidException:
-                errors["password"] = "invalid_password"
-            except aiohttp.ClientResponseError as error:
-                errors["base"] = "unexpected_response"
-                description_placeholders["error_detail"] = str(error)
-            except TimeoutError:
-                errors["base"] = "timeout"
-            except aiohttp.ClientConnectorError:
-                errors["base"] = "cannot_connect"
-            except aiohttp.ClientError as error:
-                errors["base"] = "unexpected_error"
-                description_placeholders["error_detail"] = str(error)
-            finally:
-                session.detach()
-            return self.async_show_form(
-                step_id="user",
-                data_schema=DATA_SCHEMA,
-                errors=errors,
-                description_placeholders=description_placeholders,
+                self._discovered_urls = [
+                    str(url) for url in found if str(url) not in configured_urls
+                ]
+                if self._discovered_urls:
+                    return await self.async_step_pick()
+                errors["base"] = "no_devices_found"
+
+        return self.async_show_form(
+            step_id="scan",
+            data_schema=self.add_suggested_values_to_schema(SCAN_SCHEMA, user_input),
+            errors=errors,
+        )
+
+    async def async_step_pick(self, user_input=None) -> config_entries.ConfigFlowResult:
+        """Let the user pick one of the discovered SmartBoxes."""
+        schema = vol.Schema(
+            {
+                vol.Required(CONF_URL): vol.In(self._discovered_urls),
+                vol.Optional(CONF_PASSWORD, default=""): str,
+            }
+        )
+        if user_input is not None:
+            return await self._async_create_entry_or_show_form(
+                "pick", schema, user_input
             )
 
-        return self.async_show_form(step_id="user", data_schema=DATA_SCHEMA)
+        return self.async_show_form(step_id="pick", data_schema=schema)
+
+    async def _async_create_entry_or_show_form(
+        self, step_id: str, data_schema: vol.Schema, user_input: dict
+    ) -> config_entries.ConfigFlowResult:
+        errors = {}
+        description_placeholders = {}
+        # session = aiohttp.ClientSession(
+        #     connector=aiohttp_socks.ProxyConnector.from_url(
+        #         "socks5://192.168.178.62:8889"
+        #     ),
+        #     cookie_jar=aiohttp.CookieJar(unsafe=True),
+        #     timeout=aiohttp.ClientTimeout(
+        #         total=60, connect=30, sock_connect=10, sock_read=30
+        #     ),
+        # )
+        url_str = user_input[CONF_URL].rstrip("/")
+        if "://" not in url_str:
+            url_str = "http://" + url_str
+        url = URL(url_str)
+        password = user_input.get(CONF_PASSWORD, "")
+
+        await self.async_set_unique_id(str(url))
+        self._abort_if_unique_id_configured()
+        # Entries created before the unique ID was set.
+        self._async_abort_entries_match({CONF_URL: str(url)})
+
+        session = self._get_session()
+        try:
+            api = KiwiOsApi(
+                url=url,
+                session=session,
+                password=password,
+            )
+            if password:
+                await api.login()
+            await api.get_rest()
+
+            return self.async_create_entry(
+                title=str(url),
+                data={
+                    CONF_URL: str(url),
+                    CONF_PASSWORD: password,
+                    "kiwisessionid": api.get_kiwisessionid(),
+                },
+                options={CONF_CHANNEL_POLICY: CHANNEL_POLICY_CLOUD_MAPPED},
+            )
+        except PasswordRequiredException:
+            errors["password"] = "required"
+        except PasswordInvalidException:
+            errors["password"] = "invalid_password"
+        except aiohttp.ClientResponseError as error:
+            errors["base"] = "unexpected_response"
+            description_placeholders["error_detail"] = str(error)
+        except TimeoutError:
+            errors["base"] = "timeout"
+        except aiohttp.ClientConnectorError:
+            errors["base"] = "cannot_connect"
+        except aiohttp.ClientError as error:
+            errors["base"] = "unexpected_error"
+            description_placeholders["error_detail"] = str(error)
+        return self.async_show_form(
+            step_id=step_id,
+            data_schema=data_schema,
+            errors=errors,
+            description_placeholders=description_placeholders,
+        )
+
+
+class AmpereOptionsFlow(config_entries.OptionsFlow):
+    """Options flow for Ampere PV integration."""
+
+    async def async_step_init(self, user_input=None) -> config_entries.ConfigFlowResult:
+        """Manage the options of an existing entry."""
+        if user_input is not None:
+            return self.async_create_entry(data=user_input)
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=self.add_suggested_values_to_schema(
+                OPTIONS_SCHEMA, self.config_entry.options
+            ),
+        )
@@ -1 +1,24 @@
 DOMAIN = "ampere_iq_smartbox_homeassistant"
+
+CONF_CAPTURE = "capture"
+CONF_ALIGN_POLLS = "align_polls"
+CONF_TIMESTAMP_MODE = "timestamp_mode"
+CONF_MAX_REQUEST_RATE = "max_request_rate"
+CONF_MAX_CONCURRENT_REQUESTS = "max_concurrent_requests"
+CONF_CHANNEL_POLICY = "channel_policy"
+CONF_CLOUD_TAGS = "cloud_tags"
+CONF_EXPORT = "export"
+
+TIMESTAMP_MODE_ENTITY = "entity"
+TIMESTAMP_MODE_ATTRIBUTE = "attribute"
+TIMESTAMP_MODE_NONE = "none"
+TIMESTAMP_MODES = [TIMESTAMP_MODE_ENTITY, TIMESTAMP_MODE_ATTRIBUTE, TIMESTAMP_MODE_NONE]
+
+SERVICE_SEND_COMMAND = "send_command"
+SERVICE_MEMORY_PROFILE = "memory_profile"
+
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_ITEM = "item"
+ATTR_COMMAND = "command"
+ATTR_DURATION = "duration"
+ATTR_TOP = "top"
@@ -4,13 +4,26 @@ This module provides an API wrapper for communicating with Ampere IQ Smartbox de
 handling authentication, session management and HTTP requests.
 """
 
+import asyncio
 from collections.abc import AsyncIterator, Callable
 from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import logging
 from typing import Any
+from urllib.parse import quote
 
 import aiohttp
 from yarl import URL
 
+from .kiwi_os_budget import (
+    KiwiOsRequestBudget,
+    KiwiOsRequestPriority,
+    get_request_budget,
+)
+from .kiwi_os_capture import CAPTURED_PATHS, KiwiOsCapture
+
+_LOGGER = logging.getLogger(__name__)
+
 _DBG_DISABLE_CONTENT_CHECK = True
 _JSON_CONTENT_TYPE = "application/json"
 
@@ -19,6 +32,10 @@ if _DBG_DISABLE_CONTENT_CHECK:
 
 type KiwiOsApiItems = dict[str, Any]
 
+COMMAND_INTERVAL = 2.0  # seconds between two writes
+# Things without their channels, enough to tell their status.
+THING_SUMMARY_PATH = "/rest/things?summary=true"
+
 
 class PasswordRequiredException(Exception):
     """Exception raised when the device requires a password but none is provided."""
@@ -36,6 +53,10 @@ class PasswordInvalidException(Exception):
         super().__init__(message or "Invalid password")
 
 
+def _item_path(item_name: str) -> str:
+    return f"/rest/items/{quote(item_name, safe='')}"
+
+
 class KiwiOsApi:
     """API client for Ampere IQ Smartbox.
 
@@ -50,6 +71,8 @@ class KiwiOsApi:
         password: str = "",
         kiwisessionid: str = "",
         kiwisessionid_changed_callback: Callable[[str], None] | None = None,
+        capture: KiwiOsCapture | None = None,
+        budget: KiwiOsRequestBudget | None = None,
     ) -> None:
         """Initialize the API wrapper.
 
@@ -58,10 +81,16 @@ class KiwiOsApi:
             session: aiohttp client session to use for requests.
             password: Optional password for authentication.
             kiwisessionid: Optional kiwisessionid cookie to set in the session.
+            capture: Optional capture that raw things and items responses are
+                recorded to.
+            budget: Request budget to use, defaults to the one shared by all
+                requests to the box at url.
         """
         self.session = session
         self.url = url
         self.password = password
+        self.capture = capture
+        self.budget = budget if budget is not None else get_request_budget(url)
         self._kiwisessionid_changed = kiwisessionid_changed_callback
         if kiwisessionid and (
             "kiwisessionid" not in session.cookie_jar.filter_cookies(url)
@@ -95,7 +124,7 @@ class KiwiOsApi:
                 (300 <= response.status < 400)
                 and response.headers.get("Location", "").endswith("/logon.html")
             ):
-                await self.login()
+                await self._login()
                 async with self._get(path, retry=False) as retry_response:
                     yield retry_response
                 return
@@ -131,7 +160,7 @@ class KiwiOsApi:
             if 300 <= response.status < 400:
                 location = response.headers.get("Location", "")
                 if location.endswith("/logon.html"):
-                    await self.login()
+                    await self._login()
                     async with self._post(
                         path,
                         data,
@@ -146,17 +175,30 @@ class KiwiOsApi:
         finally:
             await response.release()
 
-    async def _get_json(self, path: str) -> Any:
-        """Perform a GET request and return parsed JSON."""
-        async with self._get(path, retry=True) as response:
-            return await response.json(content_type=_JSON_CONTENT_TYPE)
+    async def _get_json(self, path: str, priority: KiwiOsRequestPriority) -> Any:
+        """Perform a GET request within the request budget and return its JSON."""
+        async with (
+            self.budget.slot(priority),
+            self._get(path, retry=True) as response,
+        ):
+            data = await response.json(content_type=_JSON_CONTENT_TYPE)
+        if self.capture is not None and path in CAPTURED_PATHS:
+            await self.capture.record(path, data)
+        return data
 
-    async def login(self) -> None:
+    async def login(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.USER
+    ) -> None:
         """Perform login to obtain kiwisessionid cookie.
 
         Returns:
             True if login was successful, False otherwise.
         """
+        async with self.budget.slot(priority):
+            await self._login()
+
+    async def _login(self) -> None:
+        """Perform login without taking a slot of the request budget."""
 
         if not self.password:
             raise PasswordRequiredException
@@ -211,14 +253,151 @@ class KiwiOsApi:
             return cookies["kiwisessionid"].value
         return ""
 
-    async def get_rest(self) -> Any:
+    async def get_rest(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.USER
+    ) -> Any:
         """Fetch the /rest endpoint."""
-        return await self._get_json("/rest")
+        return await self._get_json("/rest", priority)
 
-    async def get_things(self) -> Any:
+    async def get_things(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.POLL
+    ) -> Any:
         """Fetch the /rest/things endpoint."""
-        return await self._get_json("/rest/things")
+        return await self._get_json("/rest/things", priority)
+
+    async def get_thing_summaries(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.BACKGROUND
+    ) -> Any:
+        """Fetch the things without their channels, e.g. to check their status.
 
-    async def get_items(self) -> Any:
+        Unlike the full /rest/things, the summaries are not captured.
+        """
+        return await self._get_json(THING_SUMMARY_PATH, priority)
+
+    async def get_items(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.POLL
+    ) -> Any:
         """Fetch the /rest/items endpoint."""
-        return await self._get_json("/rest/items")
+        return await self._get_json("/rest/items", priority)
+
+    async def get_item(
+        self,
+        item_name: str,
+        priority: KiwiOsRequestPriority = KiwiOsRequestPriority.USER,
+    ) -> Any:
+        """Fetch a single item from the /rest/items endpoint."""
+        return await self._get_json(_item_path(item_name), priority)
+
+    async def send_command(self, item_name: str, command: str) -> None:
+        """Send a command to a single item.
+
+        Prefer KiwiOsCommandQueue.async_send, which coalesces and rate-limits
+        commands for the box.
+        """
+        async with (
+            self.budget.slot(KiwiOsRequestPriority.WRITE),
+            self._post(_item_path(item_name), command, retry=True),
+        ):
+            pass
+
+
+@dataclass(slots=True)
+class _PendingCommand:
+    """A command waiting to be sent, together with everyone waiting for it."""
+
+    command: str
+    futures: list[asyncio.Future[Any]] = field(default_factory=list)
+
+
+class KiwiOsCommandQueue:
+    """Queue of commands for writable items.
+
+    Commands for the same item that arrive before the previous one was sent
+    are coalesced, so only the latest value reaches the box. Writes are spaced
+    at least ``interval`` seconds apart and every write is acknowledged by
+    re-reading only the written item.
+    """
+
+    def __init__(
+        self,
+        api: KiwiOsApi,
+        interval: float = COMMAND_INTERVAL,
+        acknowledged_callback: Callable[[Any], None] | None = None,
+    ) -> None:
+        """Initialize the command queue.
+
+        Args:
+            api: API used to send the commands.
+            interval: Minimum time between two writes in seconds.
+            acknowledged_callback: Called with the re-read item after each write.
+        """
+        self.api = api
+        self.interval = interval
+        self._acknowledged = acknowledged_callback
+        self._pending: dict[str, _PendingCommand] = {}
+        self._worker: asyncio.Task[None] | None = None
+        self._last_write: float | None = None
+
+    async def async_send(self, item_name: str, command: str) -> Any:
+        """Queue a command and wait until the box acknowledged it.
+
+        Returns:
+            The item as re-read from the box after the write.
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[Any] = loop.create_future()
+        pending = self._pending.get(item_name)
+        if pending is None:
+            pending = self._pending[item_name] = _PendingCommand(command)
+        pending.command = command
+        pending.futures.append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        return await future
+
+    def pending_count(self) -> int:
+        """Return the number of items with a command waiting to be sent."""
+        return len(self._pending)
+
+    def close(self) -> None:
+        """Stop sending commands and fail all waiting callers."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for pending in self._pending.values():
+            for future in pending.futures:
+                future.cancel()
+        self._pending.clear()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            if self._last_write is not None:
+                delay = self._last_write + self.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            item_name = next(iter(self._pending))
+            pending = self._pending.pop(item_name)
+            self._last_write = loop.time()
+            try:
+                await self.api.send_command(item_name, pending.command)
+                item = await self.api.get_item(item_name, KiwiOsRequestPriority.WRITE)
+            except asyncio.CancelledError:
+                for future in pending.futures:
+                    future.cancel()
+                raise
+            except Exception as error:  # noqa: BLE001
+                for future in pending.futures:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            if self._acknowledged is not None:
+                # The box accepted the write, so the callers get the item even
+                # if handling it failed.
+                try:
+                    self._acknowledged(item)
+                except Exception:
+                    _LOGGER.exception("Error handling acknowledged item %s", item_name)
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(item)
@@ -0,0 +1,170 @@
+"""Per-box request budget for Ampere IQ Smartbox devices.
+
+The box is an embedded device whose web UI and cloud sync slow down under
+load. All requests to a box, from the config flow, setup, the coordinator and
+the command queue, share one budget that limits their rate and concurrency
+and serves waiting requests by priority.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import heapq
+import itertools
+import weakref
+
+from yarl import URL
+
+BUDGET_MAX_RATE = 1.0  # requests per second
+BUDGET_MAX_CONCURRENCY = 2
+BUDGET_WAIT_WINDOW = 100  # requests
+
+
+class KiwiOsRequestPriority(IntEnum):
+    """Priority of a request, lower values are served first."""
+
+    USER = 0
+    WRITE = 1
+    POLL = 2
+    BACKGROUND = 3
+
+
+class KiwiOsRequestBudget:
+    """Limits the rate and concurrency of the requests to one box.
+
+    Requests start at most ``max_rate`` times per second and at most
+    ``max_concurrency`` of them are in flight. Waiting requests are served in
+    order of priority, then in order of arrival.
+    """
+
+    def __init__(
+        self,
+        max_rate: float = BUDGET_MAX_RATE,
+        max_concurrency: int = BUDGET_MAX_CONCURRENCY,
+    ) -> None:
+        """Initialize the budget.
+
+        Args:
+            max_rate: Maximum number of requests started per second.
+            max_concurrency: Maximum number of requests in flight.
+        """
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._waiting: list[tuple[int, int, float, asyncio.Future[None]]] = []
+        self._sequence = itertools.count()
+        self._next_start = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self._wait_times: deque[float] = deque(maxlen=BUDGET_WAIT_WINDOW)
+        self._listeners: list[Callable[[], None]] = []
+
+    def add_listener(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """Call listener whenever requests are queued, started or finished.
+
+        Returns a function that removes the listener.
+        """
+        self._listeners.append(listener)
+
+        def remove_listener() -> None:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return remove_listener
+
+    def configure(self, max_rate: float, max_concurrency: int) -> None:
+        """Change the limits of the budget."""
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self._dispatch()
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of requests waiting for the budget."""
+        return sum(1 for *_, future in self._waiting if not future.done())
+
+    @property
+    def wait_time_avg(self) -> float | None:
+        """Return the average time in seconds recent requests waited."""
+        if not self._wait_times:
+            return None
+        return sum(self._wait_times) / len(self._wait_times)
+
+    @property
+    def wait_time_max(self) -> float | None:
+        """Return the longest time in seconds a recent request waited."""
+        if not self._wait_times:
+            return None
+        return max(self._wait_times)
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: KiwiOsRequestPriority = KiwiOsRequestPriority.POLL
+    ) -> AsyncIterator[None]:
+        """Wait until the request may start and hold its slot while running."""
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[None] = loop.create_future()
+        heapq.heappush(
+            self._waiting, (priority, next(self._sequence), loop.time(), future)
+        )
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                # Drops the cancelled request from the queue depth.
+                self._dispatch()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        self._start_waiting()
+        for listener in list(self._listeners):
+            listener()
+
+    def _start_waiting(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._waiting:
+            return
+        loop = asyncio.get_running_loop()
+        while self._waiting and self.in_flight < self.max_concurrency:
+            now = loop.time()
+            if now < self._next_start:
+                self._timer = loop.call_at(self._next_start, self._dispatch)
+                return
+            _, _, enqueued, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            self.in_flight += 1
+            self._next_start = now + 1 / self.max_rate
+            self._wait_times.append(now - enqueued)
+            future.set_result(None)
+
+
+# Budgets are kept as long as an API client or probe of the box uses them.
+_BUDGETS: weakref.WeakValueDictionary[str, KiwiOsRequestBudget] = (
+    weakref.WeakValueDictionary()
+)
+
+
+def get_request_budget(url: URL) -> KiwiOsRequestBudget:
+    """Return the budget shared by all requests to the box at url."""
+    key = str(url.origin())
+    budget = _BUDGETS.get(key)
+    if budget is None:
+        budget = _BUDGETS[key] = KiwiOsRequestBudget()
+    return budget
@@ -0,0 +1,181 @@
+"""Capture and replay of raw Ampere IQ Smartbox responses.
+
+Captures are gzip compressed JSON lines files. Every line holds one raw
+``/rest/things`` or ``/rest/items`` response together with the time it was
+received, so traffic recorded on a customer's box can be replayed offline
+through the parser or turned into test fixtures.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+import gzip
+import json
+import logging
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .kiwi_os_api import KiwiOsApiItems
+    from .kiwi_os_parser import KiwiOsParser
+    from .sensor import KiwiOsDataUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAX_BYTES = 50 * 1024 * 1024
+CAPTURED_PATHS = frozenset({"/rest/things", "/rest/items"})
+
+
+@dataclass(slots=True)
+class KiwiOsCaptureRecord:
+    """A single captured response."""
+
+    time: float
+    path: str
+    data: Any
+
+
+class KiwiOsCapture:
+    """Append-only, size capped writer for raw API responses.
+
+    Every record is written as its own gzip member, so the file stays valid
+    even if Home Assistant stops in the middle of a write. Once the file
+    reaches ``max_bytes`` further records are dropped.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = CAPTURE_MAX_BYTES) -> None:
+        """Initialize the capture.
+
+        Args:
+            path: File to append the records to.
+            max_bytes: Size of the compressed file after which capturing stops.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._full = False
+        self._lock = asyncio.Lock()
+
+    async def record(self, path: str, data: Any) -> None:
+        """Append a response to the capture without blocking the event loop."""
+        if self._full:
+            return
+        received = time.time()
+        async with self._lock:
+            written = await asyncio.get_running_loop().run_in_executor(
+                None, self._write, KiwiOsCaptureRecord(received, path, data)
+            )
+        if not written:
+            self._full = True
+            _LOGGER.warning(
+                "Capture %s reached %d bytes, no further responses are recorded",
+                self.path,
+                self.max_bytes,
+            )
+
+    def _write(self, record: KiwiOsCaptureRecord) -> bool:
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            size = 0
+        if size >= self.max_bytes:
+            return False
+        line = json.dumps(
+            {"time": record.time, "path": record.path, "data": record.data},
+            separators=(",", ":"),
+        )
+        with gzip.open(self.path, "ab") as file:
+            file.write(line.encode() + b"\n")
+        return True
+
+
+def read_capture(path: Path) -> Iterator[KiwiOsCaptureRecord]:
+    """Read the records of a capture in the order they were received."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield KiwiOsCaptureRecord(record["time"], record["path"], record["data"])
+
+
+def export_fixture(capture_path: Path, directory: Path, items_index: int = -1) -> None:
+    """Write a ``things.json``/``items.json`` pair from a capture.
+
+    Args:
+        capture_path: Capture to read.
+        directory: Directory to write the fixture files to, e.g. ``test_data``.
+        items_index: Which of the captured ``/rest/items`` responses to use.
+    """
+    things: Any = None
+    items: list[Any] = []
+    for record in read_capture(capture_path):
+        if record.path == "/rest/things":
+            things = record.data
+        elif record.path == "/rest/items":
+            items.append(record.data)
+    if things is None or not items:
+        raise ValueError(f"{capture_path} does not contain things and items")
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, data in (("things.json", things), ("items.json", items[items_index])):
+        with open(directory / name, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=4, ensure_ascii=False)
+
+
+async def async_replay(
+    capture_path: Path,
+    parser: KiwiOsParser,
+    coordinator: KiwiOsDataUpdateCoordinator | None = None,
+    speed: float = 1.0,
+    on_poll: Callable[[KiwiOsApiItems], None] | None = None,
+) -> int:
+    """Feed a capture through the parser and entity pipeline.
+
+    The first captured ``/rest/things`` response sets up the entities, every
+    ``/rest/items`` response is then parsed like a coordinator poll.
+
+    Args:
+        capture_path: Capture to replay.
+        parser: Parser to feed.
+        coordinator: Coordinator the entities are attached to, if any. Its
+            listeners are notified after every replayed poll.
+        speed: Replay speed relative to the original timing. ``0`` replays
+            as fast as possible.
+        on_poll: Called with the mapped items after every replayed poll.
+
+    Returns:
+        The number of replayed polls.
+    """
+    polls = 0
+    previous_time: float | None = None
+    things_parsed = False
+    entities_created = False
+    for record in read_capture(capture_path):
+        if speed > 0 and previous_time is not None:
+            await asyncio.sleep(max(0.0, record.time - previous_time) / speed)
+        previous_time = record.time
+
+        if record.path == "/rest/things":
+            if not things_parsed:
+                parser.parse_things(record.data, coordinator)
+                things_parsed = True
+            continue
+        if record.path != "/rest/items" or not things_parsed:
+            continue
+
+        items = parser.map_json_items(record.data)
+        if not entities_created:
+            parser.create_entities(items)
+            parser.guess_item_types(items)
+            entities_created = True
+        parser.parse_item_values(items)
+        polls += 1
+        if coordinator is not None:
+            coordinator.async_update_listeners()
+        if on_poll is not None:
+            on_poll(items)
+    return polls
@@ -0,0 +1,437 @@
+"""Home Assistant independent parsing of Ampere IQ Smartbox responses.
+
+This module only depends on the standard library, so it can be imported,
+benchmarked and run without loading Home Assistant. It turns ``/rest/things``
+into channel descriptors and ``/rest/items`` states into typed values with
+units; kiwi_os_parser adapts these records to Home Assistant entities.
+
+Run it as a script to bulk-parse captured ``things.json``/``items.json``
+pairs in parallel worker processes, e.g. for fleet audits::
+
+    python kiwi_os_core.py --jobs 8 captures/*/
+"""
+
+from __future__ import annotations
+
+import argparse
+from collections import Counter
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import json
+import logging
+from pathlib import Path
+import re
+import sys
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+ALWAYS_INCLUDE_ID_IN_NAME = True
+
+# Which channels of /rest/things to create entities for.
+CHANNEL_POLICY_CLOUD_MAPPED = "cloud_mapped"
+CHANNEL_POLICY_ALL = "all"
+CHANNEL_POLICY_CLOUD_TAGS = "cloud_tags"
+CHANNEL_POLICIES = [
+    CHANNEL_POLICY_CLOUD_MAPPED,
+    CHANNEL_POLICY_ALL,
+    CHANNEL_POLICY_CLOUD_TAGS,
+]
+# Policy of entries without one and of the command line. New entries select
+# CHANNEL_POLICY_CLOUD_MAPPED explicitly.
+CHANNEL_POLICY_DEFAULT = CHANNEL_POLICY_ALL
+
+# Status of a thing whose channels are updated, any other status means its
+# items keep stale or undefined states.
+THING_STATUS_ONLINE = "ONLINE"
+
+# Unit suffix of a state -> conversion factor, unit, device class, state class.
+# Device and state classes use the values of Home Assistant's SensorDeviceClass
+# and SensorStateClass.
+_UNITS: dict[str, tuple[float, str, str | None, str]] = {
+    " W": (1.0, "W", "power", "measurement"),
+    " °C": (1.0, "°C", "temperature", "measurement"),
+    " Ws": (1.0 / (60 * 60 * 1000), "kWh", "energy", "total_increasing"),
+    " Wh": (1.0 / 1000, "kWh", "energy", "total_increasing"),
+    " kWh": (1.0, "kWh", "energy", "total_increasing"),
+    " V": (1.0, "V", "voltage", "measurement"),
+    " A": (1.0, "A", "current", "measurement"),
+    " %": (1.0, "%", None, "measurement"),
+}
+
+# Unit suffix assumed for an UNDEF state, by item type.
+_UNDEF_UNITS: dict[str, str] = {
+    "Number:Power": " W",
+    "Number:Temperature": " °C",
+    "Number:Energy": " Ws",  # " kWh" is also possible
+    "Number:ElectricPotential": " V",
+    "Number:ElectricCurrent": " A",
+    "Number:Dimensionless": " %",
+}
+
+_BATTERY_PATTERN = re.compile("battery", re.IGNORECASE)
+_MODE_PATTERN = re.compile("mode", re.IGNORECASE)
+_TOTAL_PATTERN = re.compile("total", re.IGNORECASE)
+
+
+@dataclass(slots=True)
+class KiwiOsDevice:
+    """A thing of the box, e.g. an inverter, battery or meter."""
+
+    uid: str
+    name: str
+    manufacturer: str
+    model: str
+    model_id: str
+    serial_number: str
+    sw_version: str
+    hw_version: str
+    created_at: str
+
+
+@dataclass(slots=True)
+class KiwiOsChannel:
+    """A channel of a thing together with the item it is linked to."""
+
+    uid: str
+    id: str
+    item_name: str
+    name: str
+    device: KiwiOsDevice
+
+
+@dataclass(slots=True)
+class KiwiOsValueType:
+    """How to interpret the states of an item."""
+
+    unit_string: str = ""
+    conversion_factor: float | None = None
+    unit: str | None = None
+    device_class: str | None = None
+    state_class: str | None = None
+
+
+@dataclass(slots=True)
+class KiwiOsValue:
+    """A parsed item state."""
+
+    value: float | str | None
+    unit: str | None = None
+    timestamp_ms: int | None = None
+
+
+def parse_device(thing: Any) -> KiwiOsDevice:
+    """Parse the device description of a thing."""
+    thing_uid = thing["UID"]
+    configuration = thing.get("configuration", {})
+    properties = thing.get("properties", {})
+    return KiwiOsDevice(
+        uid=thing_uid,
+        name=thing.get("label", thing_uid),
+        manufacturer=properties.get("vendor", ""),
+        model=properties.get("modelName", ""),
+        model_id=properties.get("modelId", ""),
+        serial_number=properties.get("serialNumber", ""),
+        sw_version=properties.get("displaySWVersion", ""),
+        hw_version=properties.get("displayHWVersion", ""),
+        created_at=configuration.get("dateInstallation", ""),
+    )
+
+
+def parse_thing_statuses(things: Any) -> dict[str, str]:
+    """Parse the status of every thing from /rest/things, keyed by thing UID."""
+    return {
+        thing["UID"]: thing.get("statusInfo", {}).get("status", "UNKNOWN")
+        for thing in things
+    }
+
+
+def select_channel(channel: Any, policy: str, cloud_tags: Collection[str] = ()) -> bool:
+    """Check whether a channel is selected by a channel policy.
+
+    Args:
+        channel: Channel from /rest/things.
+        policy: One of CHANNEL_POLICIES. Cloud mapped channels are those the
+            box itself reports to the cloud, which excludes raw registers.
+        cloud_tags: The ``kig.meta.cloudtag`` values selected by
+            CHANNEL_POLICY_CLOUD_TAGS.
+    """
+    if policy == CHANNEL_POLICY_ALL:
+        return True
+    properties = channel.get("properties", {})
+    if policy == CHANNEL_POLICY_CLOUD_TAGS:
+        return properties.get("kig.meta.cloudtag") in cloud_tags
+    return "cloud-mapped" in properties.get("kig.meta.scope", "").split()
+
+
+def parse_channels(
+    things: Any,
+    policy: str = CHANNEL_POLICY_DEFAULT,
+    cloud_tags: Collection[str] = (),
+) -> list[KiwiOsChannel]:
+    """Parse the channels with a linked item from /rest/things.
+
+    Args:
+        things: Response of /rest/things.
+        policy: Channel policy selecting the channels, see select_channel.
+        cloud_tags: Cloud tags selected by CHANNEL_POLICY_CLOUD_TAGS.
+    """
+    channels: list[KiwiOsChannel] = []
+    all_labels: set[str] = set()
+    duplicate_labels: set[str] = set()
+    for thing in things:
+        device = parse_device(thing)
+        for channel in thing.get("channels", []):
+            linked_items = channel.get("linkedItems", [])
+            if not linked_items or not select_channel(channel, policy, cloud_tags):
+                continue
+
+            label: str = channel["label"]
+            if label in all_labels:
+                duplicate_labels.add(label)
+            all_labels.add(label)
+            channels.append(
+                KiwiOsChannel(
+                    uid=channel["uid"],
+                    id=channel["id"],
+                    item_name=linked_items[0],
+                    name=label,
+                    device=device,
+                )
+            )
+
+    for channel in channels:
+        if ALWAYS_INCLUDE_ID_IN_NAME or channel.name in duplicate_labels:
+            channel.name = f"{channel.name} ({channel.id})"
+    return channels
+
+
+def map_json_items(
+    json_items: Any, item_names: Collection[str] | None = None
+) -> dict[str, Any]:
+    """Map the items from /rest/items by their name.
+
+    Args:
+        json_items: Response of /rest/items.
+        item_names: If given, only these items are mapped.
+    """
+    if item_names is None:
+        return {json_item["name"]: json_item for json_item in json_items}
+    return {
+        name: json_item
+        for json_item in json_items
+        if (name := json_item["name"]) in item_names
+    }
+
+
+def guess_value_type(item: Any, label: str = "") -> KiwiOsValueType:
+    """Guess how to interpret the states of an item from its current state."""
+    item_state: str = item["state"]
+    item_type: str = item["type"]
+    item_name: str = item["name"]
+
+    value_type = KiwiOsValueType()
+    unit_string: str | None = None
+    if item_state == "UNDEF":
+        unit_string = _UNDEF_UNITS.get(item_type)
+        if unit_string is None:
+            _LOGGER.warning(f"Unknown type: {item_type!r} with state {item_state!r}")
+    elif item_state and " " in item_state:
+        unit_string = item_state[item_state.rfind(" ") :]
+
+    if unit_string is not None:
+        value_type.unit_string = unit_string
+        unit = _UNITS.get(unit_string)
+        if unit is not None:
+            (
+                value_type.conversion_factor,
+                value_type.unit,
+                value_type.device_class,
+                value_type.state_class,
+            ) = unit
+            if unit_string == " %" and _BATTERY_PATTERN.search(item_name):
+                value_type.device_class = "battery"
+        else:
+            _LOGGER.warning(
+                f"Unknown unit string: {unit_string!r} for state: {item_state!r} and type {item_type!r}"
+            )
+            value_type.conversion_factor = 1.0
+            value_type.unit = unit_string[1:]
+    elif item_type in {"Number", "String"}:
+        if item_type == "Number":
+            value_type.conversion_factor = 1.0
+        value_type.state_class = "measurement"
+        if _MODE_PATTERN.search(item_name):
+            value_type.device_class = "enum"
+    else:
+        _LOGGER.warning(
+            f"Cannot guess type for state: {item_state!r} and type {item_type!r}"
+        )
+
+    if value_type.state_class == "measurement" and (
+        _TOTAL_PATTERN.search(item_name) or _TOTAL_PATTERN.search(label)
+    ):
+        value_type.state_class = "total"
+    return value_type
+
+
+def value_type_matches(item_state: str, value_type: KiwiOsValueType) -> bool:
+    """Check whether a state can be parsed with the given value type."""
+    if item_state == "UNDEF":
+        return True
+    if value_type.unit_string == "":
+        return " " not in item_state
+    return item_state.endswith(value_type.unit_string)
+
+
+def parse_value(item_state: str, value_type: KiwiOsValueType) -> KiwiOsValue:
+    """Parse a state like ``1760711100000|8912.5 Ws`` into a value.
+
+    Args:
+        item_state: State of the item, matching value_type.
+        value_type: How to interpret the state.
+    """
+    if item_state == "UNDEF":
+        return KiwiOsValue(None, value_type.unit)
+
+    value_str = item_state
+    if value_type.unit_string != "":
+        value_str = item_state[: -len(value_type.unit_string)]
+
+    timestamp_ms: int | None = None
+    if "|" in value_str:
+        split = value_str.split("|")
+        value_str = split[-1]
+        timestamp_str = split[0].strip()
+        try:
+            timestamp_ms = int(timestamp_str)
+        except ValueError:
+            _LOGGER.error(
+                f"Cannot convert timestamp string to int: {timestamp_str!r} from state: {item_state!r}"
+            )
+
+    value_str = value_str.strip()
+
+    if value_type.conversion_factor is None:
+        return KiwiOsValue(value_str, value_type.unit, timestamp_ms)
+    try:
+        value = float(value_str) * value_type.conversion_factor
+    except ValueError:
+        _LOGGER.warning(
+            f"Cannot convert value string to float: {value_str!r} from state: {item_state!r}"
+        )
+        return KiwiOsValue(value_str, value_type.unit, timestamp_ms)
+    return KiwiOsValue(value, value_type.unit, timestamp_ms)
+
+
+def parse_snapshot(
+    channels: Iterable[KiwiOsChannel], items: dict[str, Any]
+) -> Iterator[tuple[KiwiOsChannel, KiwiOsValue]]:
+    """Parse the values of all channels from one /rest/items response."""
+    for channel in channels:
+        item = items.get(channel.item_name)
+        if item is None:
+            continue
+        value_type = guess_value_type(item, channel.name)
+        yield channel, parse_value(item["state"], value_type)
+
+
+def audit_directory(
+    directory: str,
+    policy: str = CHANNEL_POLICY_DEFAULT,
+    include_values: bool = False,
+    cloud_tags: Collection[str] = (),
+) -> dict[str, Any]:
+    """Parse a things.json/items.json pair and summarize the result."""
+    path = Path(directory)
+    with open(path / "things.json", encoding="utf-8") as file:
+        things = json.load(file)
+    with open(path / "items.json", encoding="utf-8") as file:
+        items = map_json_items(json.load(file))
+
+    channels = parse_channels(things, policy, cloud_tags)
+    units: Counter[str] = Counter()
+    values: dict[str, Any] = {}
+    undefined = 0
+    timestamped = 0
+    for channel, value in parse_snapshot(channels, items):
+        units[value.unit or ""] += 1
+        if value.value is None:
+            undefined += 1
+        if value.timestamp_ms is not None:
+            timestamped += 1
+        if include_values:
+            values[channel.item_name] = {
+                "value": value.value,
+                "unit": value.unit,
+                "timestamp_ms": value.timestamp_ms,
+            }
+
+    summary: dict[str, Any] = {
+        "directory": str(path),
+        "things": len(things),
+        "channels": len(channels),
+        "missing_items": sum(1 for c in channels if c.item_name not in items),
+        "undefined": undefined,
+        "timestamped": timestamped,
+        "units": dict(units),
+    }
+    if include_values:
+        summary["values"] = values
+    return summary
+
+
+def _audit(args: tuple[str, str, bool, list[str]]) -> dict[str, Any]:
+    directory, policy, include_values, cloud_tags = args
+    try:
+        return audit_directory(directory, policy, include_values, cloud_tags)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        return {"directory": directory, "error": str(error)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Bulk-parse things.json/items.json pairs and print one JSON line each."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "directories",
+        nargs="+",
+        help="directories containing a things.json and an items.json",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--policy",
+        choices=CHANNEL_POLICIES,
+        default=CHANNEL_POLICY_DEFAULT,
+        help="channels to parse",
+    )
+    parser.add_argument(
+        "--cloud-tags",
+        default="",
+        help=f"comma separated cloud tags parsed with --policy {CHANNEL_POLICY_CLOUD_TAGS}",
+    )
+    parser.add_argument(
+        "--values", action="store_true", help="include all parsed values"
+    )
+    args = parser.parse_args(argv)
+    cloud_tags = [tag.strip() for tag in args.cloud_tags.split(",") if tag.strip()]
+
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for summary in executor.map(
+            _audit,
+            [
+                (directory, args.policy, args.values, cloud_tags)
+                for directory in args.directories
+            ],
+            chunksize=8,
+        ):
+            failed = failed or "error" in summary
+            print(json.dumps(summary, ensure_ascii=False))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
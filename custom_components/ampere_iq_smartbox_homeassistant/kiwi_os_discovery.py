@@ -0,0 +1,108 @@
+"""LAN discovery of Ampere IQ Smartbox devices.
+
+Probes the ``/rest`` endpoint of a list of hosts or whole subnets
+concurrently. A host counts as a box if it answers with JSON, or redirects to
+the KiwiOS login page when it is password protected.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Iterable
+import ipaddress
+import re
+
+import aiohttp
+from yarl import URL
+
+from .kiwi_os_budget import KiwiOsRequestPriority, get_request_budget
+
+DISCOVERY_CONCURRENCY = 64
+DISCOVERY_TIMEOUT = 2.0  # seconds
+MAX_DISCOVERY_HOSTS = 1024
+
+
+def expand_hosts(hosts: str) -> list[str]:
+    """Expand a list of hosts and subnets into single hosts.
+
+    Args:
+        hosts: Host names, addresses, ``host:port`` pairs, URLs or subnets like
+            ``192.168.1.0/24``, separated by commas or whitespace.
+
+    Raises:
+        ValueError: If a subnet is invalid or the list expands to more than
+            MAX_DISCOVERY_HOSTS hosts.
+    """
+    expanded: dict[str, None] = {}
+    for token in re.split(r"[\s,;]+", hosts.strip()):
+        if not token:
+            continue
+        if "/" in token and "://" not in token:
+            network = ipaddress.ip_network(token, strict=False)
+            if network.num_addresses > MAX_DISCOVERY_HOSTS + 2:
+                raise ValueError(f"Subnet {token} is too large")
+            for address in network.hosts():
+                expanded[str(address)] = None
+        else:
+            expanded[token] = None
+        if len(expanded) > MAX_DISCOVERY_HOSTS:
+            raise ValueError(f"More than {MAX_DISCOVERY_HOSTS} hosts")
+    return list(expanded)
+
+
+def host_url(host: str) -> URL:
+    """Return the base URL for a host as it is stored in the config entry."""
+    if "://" not in host:
+        host = "http://" + host
+    return URL(host.rstrip("/"))
+
+
+async def async_probe(
+    session: aiohttp.ClientSession, url: URL, timeout: float = DISCOVERY_TIMEOUT
+) -> bool:
+    """Check whether a box answers at the given base URL.
+
+    The probe shares the request budget of the box, so probing a box that is
+    already set up does not add to its load. The timeout includes the wait
+    for the budget.
+    """
+    try:
+        async with (
+            asyncio.timeout(timeout),
+            get_request_budget(url).slot(KiwiOsRequestPriority.USER),
+            session.get(url.join(URL("/rest")), allow_redirects=False) as response,
+        ):
+            if 300 <= response.status < 400:
+                return response.headers.get("Location", "").endswith("/logon.html")
+            if not 200 <= response.status < 300:
+                return False
+            data = await response.json(content_type=None)
+    except (aiohttp.ClientError, TimeoutError, ValueError):
+        return False
+    return isinstance(data, dict)
+
+
+async def async_discover(
+    session: aiohttp.ClientSession,
+    hosts: Iterable[str],
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    timeout: float = DISCOVERY_TIMEOUT,
+) -> list[URL]:
+    """Probe hosts concurrently and return the base URLs of the boxes found.
+
+    Args:
+        session: Session shared by all probes.
+        hosts: Hosts to probe, see expand_hosts.
+        concurrency: Maximum number of probes in flight.
+        timeout: Total timeout of a single probe in seconds.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(url: URL) -> URL | None:
+        async with semaphore:
+            if await async_probe(session, url, timeout):
+                return url
+            return None
+
+    results = await asyncio.gather(*(probe(host_url(host)) for host in hosts))
+    return [url for url in results if url is not None]
@@ -0,0 +1,200 @@
+"""Columnar export of polled Ampere IQ Smartbox values to local files.
+
+Polled values are buffered in memory column by column and written in batches
+to one gzip compressed file per day of writing. Every batch is a JSON line holding one
+list per column, so bulk readers can load whole columns without going through
+the recorder.
+
+Values with a device timestamp are exported once per timestamp, values without
+one once per poll. The ``source`` column tells which of the two the
+``timestamp`` column holds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import UTC, date, datetime, timedelta
+import gzip
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+EXPORT_FLUSH_ROWS = 5000
+EXPORT_FLUSH_INTERVAL = 10 * 60  # seconds
+EXPORT_MAX_ROWS = 50000
+EXPORT_RETENTION_DAYS = 30
+EXPORT_COLUMNS = ("timestamp", "source", "item", "value", "unit")
+
+# Values of the source column.
+EXPORT_SOURCE_DEVICE = "device"
+EXPORT_SOURCE_POLL = "poll"
+
+type KiwiOsExportColumns = dict[str, list[Any]]
+
+
+def _empty_columns() -> KiwiOsExportColumns:
+    return {column: [] for column in EXPORT_COLUMNS}
+
+
+class KiwiOsColumnarExporter:
+    """Buffers polled values and writes them to rolling daily files.
+
+    The buffer holds at most ``max_rows`` rows; if the files cannot be written
+    fast enough, or a write fails and its rows are put back, the oldest rows
+    are dropped. Files older than
+    ``retention_days`` are deleted after each write.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        executor: Callable[..., Awaitable[Any]],
+        flush_rows: int = EXPORT_FLUSH_ROWS,
+        flush_interval: float = EXPORT_FLUSH_INTERVAL,
+        max_rows: int = EXPORT_MAX_ROWS,
+        retention_days: int = EXPORT_RETENTION_DAYS,
+    ) -> None:
+        """Initialize the exporter.
+
+        Args:
+            directory: Directory the daily files are written to.
+            executor: Runs a blocking function with its arguments off the event
+                loop, e.g. HomeAssistant.async_add_executor_job.
+            flush_rows: Number of buffered rows after which a flush is due.
+            flush_interval: Seconds after which buffered rows are due to be
+                flushed, even if there are fewer than flush_rows.
+            max_rows: Maximum number of rows kept in memory.
+            retention_days: Number of days the files are kept.
+        """
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.retention_days = retention_days
+        self.dropped_rows = 0
+        self._executor = executor
+        self._columns = _empty_columns()
+        self._first_append: float | None = None
+        # Last exported device timestamp of every item.
+        self._timestamps_ms: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def buffered_rows(self) -> int:
+        """Return the number of rows waiting to be written."""
+        return len(self._columns["timestamp"])
+
+    def append(
+        self,
+        polled_at: float,
+        values: Iterable[tuple[str, Any, str | None, int | None]],
+    ) -> None:
+        """Buffer the values of one poll.
+
+        Values whose device timestamp did not advance since the last poll are
+        skipped.
+
+        Args:
+            polled_at: Local epoch time in seconds of the poll, used for values
+                without a device timestamp.
+            values: Item name, value, unit and device timestamp in epoch
+                milliseconds of every value.
+        """
+        timestamps = self._columns["timestamp"]
+        sources = self._columns["source"]
+        item_names = self._columns["item"]
+        column_values = self._columns["value"]
+        units = self._columns["unit"]
+        last_timestamps_ms = self._timestamps_ms
+        polled_at_ms = int(polled_at * 1000)
+        for item_name, value, unit, timestamp_ms in values:
+            if value is None:
+                continue
+            if timestamp_ms is None:
+                timestamps.append(polled_at_ms)
+                sources.append(EXPORT_SOURCE_POLL)
+            elif last_timestamps_ms.get(item_name) == timestamp_ms:
+                continue
+            else:
+                last_timestamps_ms[item_name] = timestamp_ms
+                timestamps.append(timestamp_ms)
+                sources.append(EXPORT_SOURCE_DEVICE)
+            item_names.append(item_name)
+            column_values.append(value)
+            units.append(unit)
+        if self._first_append is None:
+            self._first_append = polled_at
+        self._drop_excess_rows()
+
+    def _drop_excess_rows(self) -> None:
+        excess = self.buffered_rows - self.max_rows
+        if excess > 0:
+            if not self.dropped_rows:
+                _LOGGER.warning(
+                    "Export buffer of %s is full, dropping the oldest rows",
+                    self.directory,
+                )
+            self.dropped_rows += excess
+            for column in self._columns.values():
+                del column[:excess]
+
+    def flush_due(self, now: float | None = None) -> bool:
+        """Check whether the buffered rows should be written."""
+        if self._lock.locked() or self._first_append is None:
+            return False
+        if self.buffered_rows >= self.flush_rows:
+            return True
+        if now is None:
+            now = time.time()
+        return now - self._first_append >= self.flush_interval
+
+    async def async_flush(self) -> None:
+        """Write the buffered rows off the event loop."""
+        async with self._lock:
+            if not self.buffered_rows:
+                return
+            columns = self._columns
+            first_append = self._first_append
+            self._columns = _empty_columns()
+            self._first_append = None
+            try:
+                await self._executor(self._write, columns)
+            except OSError as error:
+                _LOGGER.error("Cannot write export to %s: %s", self.directory, error)
+                self._restore(columns, first_append)
+            except asyncio.CancelledError:
+                self._restore(columns, first_append)
+                raise
+
+    def _restore(
+        self, columns: KiwiOsExportColumns, first_append: float | None
+    ) -> None:
+        """Put the rows of a failed write back in front of the buffer."""
+        for name, column in self._columns.items():
+            self._columns[name] = columns[name] + column
+        if first_append is not None and (
+            self._first_append is None or first_append < self._first_append
+        ):
+            self._first_append = first_append
+        self._drop_excess_rows()
+
+    def _write(self, columns: KiwiOsExportColumns) -> None:
+        today = datetime.now(tz=UTC).date()
+        line = json.dumps(columns, separators=(",", ":"), ensure_ascii=False)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.directory / f"{today}.jsonl.gz", "ab") as file:
+            file.write(line.encode() + b"\n")
+
+        oldest = today - timedelta(days=self.retention_days)
+        for path in self.directory.glob("*.jsonl.gz"):
+            try:
+                day = date.fromisoformat(path.name.removesuffix(".jsonl.gz"))
+            except ValueError:
+                continue
+            if day < oldest:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,123 @@
+"""Local feed of the parsed Ampere IQ Smartbox snapshots.
+
+Every poll of a box is re-published, already parsed and unit converted, to
+local subscribers. A subscriber first gets the full snapshot and then only the
+values that changed, so other consumers on the same network do not need to
+poll the box themselves.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable
+import logging
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+type KiwiOsFeedValues = dict[str, dict[str, Any]]
+type KiwiOsFeedCallback = Callable[[KiwiOsFeedValues, float], None]
+
+
+class KiwiOsSnapshotFeed:
+    """Latest parsed values of one box and the subscribers to their changes."""
+
+    def __init__(self) -> None:
+        """Initialize an empty feed."""
+        self.polled_at: float | None = None
+        self._values: KiwiOsFeedValues = {}
+        self._subscribers: list[KiwiOsFeedCallback] = []
+
+    @property
+    def subscriber_count(self) -> int:
+        """Return the number of subscribers."""
+        return len(self._subscribers)
+
+    def snapshot(self) -> KiwiOsFeedValues:
+        """Return the latest value, unit and device timestamp of every item."""
+        return {item_name: dict(value) for item_name, value in self._values.items()}
+
+    def publish(
+        self,
+        polled_at: float,
+        values: Iterable[tuple[str, Any, str | None, int | None]],
+    ) -> KiwiOsFeedValues:
+        """Update the snapshot with one poll and notify the subscribers.
+
+        Args:
+            polled_at: Local epoch time in seconds of the poll.
+            values: Item name, value, unit and device timestamp in epoch
+                milliseconds of every value.
+
+        Returns:
+            The values that changed, keyed by item name.
+        """
+        self.polled_at = polled_at
+        delta: KiwiOsFeedValues = {}
+        for item_name, value, unit, timestamp_ms in values:
+            previous = self._values.get(item_name)
+            if (
+                previous is not None
+                and previous["value"] == value
+                and previous["unit"] == unit
+                and previous["timestamp"] == timestamp_ms
+            ):
+                continue
+            delta[item_name] = self._values[item_name] = {
+                "value": value,
+                "unit": unit,
+                "timestamp": timestamp_ms,
+            }
+
+        self._notify(delta, polled_at)
+        return delta
+
+    def mark_unavailable(self, item_names: Iterable[str]) -> KiwiOsFeedValues:
+        """Clear the values of items that are no longer polled.
+
+        The items stay in the snapshot with neither value nor timestamp, and
+        the subscribers are notified like after a poll.
+
+        Returns:
+            The values that changed, keyed by item name.
+        """
+        delta: KiwiOsFeedValues = {}
+        for item_name in item_names:
+            previous = self._values.get(item_name)
+            if previous is None or (
+                previous["value"] is None and previous["timestamp"] is None
+            ):
+                continue
+            delta[item_name] = self._values[item_name] = {
+                "value": None,
+                "unit": previous["unit"],
+                "timestamp": None,
+            }
+        if self.polled_at is not None:
+            self._notify(delta, self.polled_at)
+        return delta
+
+    def _notify(self, delta: KiwiOsFeedValues, polled_at: float) -> None:
+        if not delta:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(delta, polled_at)
+            except Exception:
+                _LOGGER.exception("Error in snapshot feed subscriber")
+
+    def subscribe(self, callback: KiwiOsFeedCallback) -> Callable[[], None]:
+        """Call callback with the changed values of every poll.
+
+        Returns a function that removes the subscription.
+        """
+        self._subscribers.append(callback)
+
+        def unsubscribe() -> None:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def close(self) -> None:
+        """Remove all subscribers."""
+        self._subscribers.clear()
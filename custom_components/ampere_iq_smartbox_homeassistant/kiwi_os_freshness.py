@@ -0,0 +1,81 @@
+"""Data freshness tracking for Ampere IQ Smartbox values.
+
+The harmonized items carry the device time at which their value was computed.
+Comparing it with the time the value is written to Home Assistant gives the
+end-to-end lag of every value, and a timestamp that stops advancing shows that
+an item, or the whole box, got stuck.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Mapping
+import math
+
+FRESHNESS_WINDOW = 1000  # lag samples
+STALL_TIMEOUT = 15 * 60  # seconds
+
+
+class KiwiOsFreshnessTracker:
+    """Rolling distribution of the data lag of one box."""
+
+    def __init__(
+        self, window: int = FRESHNESS_WINDOW, stall_timeout: float = STALL_TIMEOUT
+    ) -> None:
+        """Initialize the tracker.
+
+        Args:
+            window: Number of lag samples the distribution is computed from.
+            stall_timeout: Seconds without a new device timestamp after which
+                an item counts as stalled.
+        """
+        self.stall_timeout = stall_timeout
+        self._lags: deque[float] = deque(maxlen=window)
+        self._advanced: dict[str, tuple[int, float]] = {}
+        self._now: float | None = None
+
+    def record(self, item_timestamps_ms: Mapping[str, int], written_at: float) -> None:
+        """Record the device timestamps of the values written in one poll.
+
+        Only values with a new timestamp add a lag sample, a value written
+        again by a later poll is not any more or less late. Items missing from
+        item_timestamps_ms, e.g. those of offline things, are forgotten.
+
+        Args:
+            item_timestamps_ms: Device timestamp in epoch milliseconds per item.
+            written_at: Local epoch time in seconds the values were written at.
+        """
+        self._now = written_at
+        for item_name in self._advanced.keys() - item_timestamps_ms.keys():
+            del self._advanced[item_name]
+        for item_name, timestamp_ms in item_timestamps_ms.items():
+            advanced = self._advanced.get(item_name)
+            if advanced is None or advanced[0] != timestamp_ms:
+                self._advanced[item_name] = (timestamp_ms, written_at)
+                self._lags.append(written_at - timestamp_ms / 1000)
+
+    @property
+    def max_lag(self) -> float | None:
+        """Return the largest lag in seconds within the window."""
+        if not self._lags:
+            return None
+        return max(self._lags)
+
+    @property
+    def p95_lag(self) -> float | None:
+        """Return the 95th percentile of the lag in seconds within the window."""
+        if not self._lags:
+            return None
+        lags = sorted(self._lags)
+        return lags[max(0, math.ceil(len(lags) * 0.95) - 1)]
+
+    @property
+    def stalled_items(self) -> list[str]:
+        """Return the items whose timestamp did not advance for stall_timeout."""
+        if self._now is None:
+            return []
+        return [
+            item_name
+            for item_name, (_, advanced_at) in self._advanced.items()
+            if self._now - advanced_at >= self.stall_timeout
+        ]
@@ -0,0 +1,177 @@
+"""Memory profiling of the Ampere IQ Smartbox integration.
+
+Uses tracemalloc to find the allocations made by this integration while a
+profile is running. tracemalloc is process wide and slows down every
+allocation, so it is only enabled for the duration of a profile. Snapshots,
+and with them the allocation sites, always cover all boxes of the
+integration; only the statistics of the polls are per box.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+import time
+import tracemalloc
+from typing import Any
+
+MEMORY_TRACE_FRAMES = 25
+MEMORY_POLL_WINDOW = 100  # polls
+MEMORY_TOP_SITES = 10
+
+_PACKAGE_FILES = str(Path(__file__).parent / "*")
+_FILTERS = [tracemalloc.Filter(True, _PACKAGE_FILES, all_frames=True)]
+
+# Number of running profiles, tracemalloc is stopped when the last one ends
+# unless it was already tracing before the first one started.
+_profiles = 0
+_started_tracing = False
+
+
+def _start_tracing() -> None:
+    global _profiles, _started_tracing
+    if _profiles == 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+        _started_tracing = True
+    _profiles += 1
+
+
+def _stop_tracing() -> None:
+    global _profiles, _started_tracing
+    _profiles -= 1
+    if _profiles == 0 and _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """Take a snapshot of the traced allocations made by this integration.
+
+    An allocation belongs to the integration if any frame of its traceback is
+    in one of its files, so e.g. the JSON decoding of a response requested by
+    the integration is included.
+    """
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+
+def _site(stat: tracemalloc.StatisticDiff | tracemalloc.Statistic) -> str:
+    # The innermost frame of the integration is the most useful one, frames
+    # of the standard library or aiohttp are the same for every site.
+    for frame in stat.traceback:
+        if Path(frame.filename).is_relative_to(Path(__file__).parent):
+            return f"{Path(frame.filename).name}:{frame.lineno}"
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def top_sites(
+    snapshot: tracemalloc.Snapshot,
+    baseline: tracemalloc.Snapshot | None = None,
+    limit: int = MEMORY_TOP_SITES,
+) -> list[dict[str, Any]]:
+    """Return the allocation sites holding the most memory.
+
+    Args:
+        snapshot: Snapshot from take_snapshot.
+        baseline: Optional earlier snapshot, if given the sites are ordered by
+            their growth since then.
+        limit: Maximum number of sites returned.
+    """
+    sites: dict[str, dict[str, Any]] = {}
+    if baseline is None:
+        for stat in snapshot.statistics("traceback"):
+            site = sites.setdefault(_site(stat), {"size": 0, "count": 0})
+            site["size"] += stat.size
+            site["count"] += stat.count
+        key = "size"
+    else:
+        for stat in snapshot.compare_to(baseline, "traceback"):
+            site = sites.setdefault(
+                _site(stat), {"size": 0, "count": 0, "size_diff": 0, "count_diff": 0}
+            )
+            site["size"] += stat.size
+            site["count"] += stat.count
+            site["size_diff"] += stat.size_diff
+            site["count_diff"] += stat.count_diff
+        key = "size_diff"
+    ordered = sorted(sites.items(), key=lambda site: site[1][key], reverse=True)
+    return [{"site": name, **site} for name, site in ordered[:limit]]
+
+
+def summarize(
+    snapshot: tracemalloc.Snapshot,
+    baseline: tracemalloc.Snapshot,
+    limit: int = MEMORY_TOP_SITES,
+) -> dict[str, Any]:
+    """Return the traced totals and the top sites of a snapshot.
+
+    Goes through every trace of both snapshots, so it should be run off the
+    event loop.
+    """
+    stats = snapshot.statistics("filename")
+    return {
+        "traced_size": sum(stat.size for stat in stats),
+        "traced_blocks": sum(stat.count for stat in stats),
+        "top_sites": top_sites(snapshot, baseline, limit),
+    }
+
+
+class KiwiOsMemoryProfiler:
+    """Per box memory profile of the polls made while a profile is running."""
+
+    def __init__(self, window: int = MEMORY_POLL_WINDOW) -> None:
+        """Initialize the profiler.
+
+        Args:
+            window: Number of polls whose statistics are kept.
+        """
+        self.polls: deque[dict[str, Any]] = deque(maxlen=window)
+        self._running = 0
+
+    @property
+    def running(self) -> bool:
+        """Return whether a profile is running."""
+        return self._running > 0
+
+    @contextmanager
+    def measure_poll(self) -> Iterator[None]:
+        """Record the allocations of the code run within the context.
+
+        Does nothing unless a profile is running. Only the traced and
+        allocated totals are compared, which takes constant time on the event
+        loop. The context must not await, or allocations of unrelated tasks
+        are counted too; allocations of other threads still are.
+        """
+        if not self.running:
+            yield
+            return
+        tracemalloc.reset_peak()
+        traced_before, _ = tracemalloc.get_traced_memory()
+        blocks_before = sys.getallocatedblocks()
+        started = time.perf_counter()
+        yield
+        duration = time.perf_counter() - started
+        traced_after, traced_peak = tracemalloc.get_traced_memory()
+        self.polls.append(
+            {
+                "time": time.time(),
+                "duration": duration,
+                "peak_size": traced_peak - traced_before,
+                "retained_size": traced_after - traced_before,
+                "retained_blocks": sys.getallocatedblocks() - blocks_before,
+            }
+        )
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """Trace allocations while the context is active."""
+        _start_tracing()
+        self._running += 1
+        try:
+            yield
+        finally:
+            self._running -= 1
+            _stop_tracing()
@@ -1,29 +1,42 @@
+"""Home Assistant adapter for the Ampere IQ Smartbox parser core.
+
+The parsing itself lives in kiwi_os_core, which does not depend on Home
+Assistant. This module maps its channel descriptors and values to sensor
+entities.
+"""
+
 from __future__ import annotations
 
+from collections.abc import Collection, Iterator
 from datetime import UTC, datetime
-import json
-import re
-from typing import Any, cast
+import logging
+from typing import TYPE_CHECKING, Any, cast
 
 from homeassistant.components.sensor import (
-    _LOGGER,
     SensorDeviceClass,
     SensorEntity,
     SensorStateClass,
-    UnitOfTemperature,
-)
-from homeassistant.const import (
-    PERCENTAGE,
-    UnitOfElectricCurrent,
-    UnitOfElectricPotential,
-    UnitOfEnergy,
-    UnitOfPower,
 )
 from homeassistant.helpers.device_registry import DeviceInfo
 
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    TIMESTAMP_MODE_ATTRIBUTE,
+    TIMESTAMP_MODE_ENTITY,
+    TIMESTAMP_MODE_NONE,
+)
 from .kiwi_os_api import KiwiOsApiItems
-from typing import TYPE_CHECKING
+from .kiwi_os_core import (
+    CHANNEL_POLICY_DEFAULT,
+    THING_STATUS_ONLINE,
+    KiwiOsDevice,
+    guess_value_type,
+    map_json_items,
+    parse_channels,
+    parse_thing_statuses,
+    parse_value,
+    value_type_matches,
+)
 
 # Import sensor classes lazily inside functions to avoid circular imports at module
 # import time (sensor.py imports this parser). For typing only, import under
@@ -35,15 +48,30 @@ if TYPE_CHECKING:
         KiwiOsTimestampSensorEntity,
     )
 
-# from const import DOMAIN
-# from sensor import (
-#     KiwiOsApiItems,
-#     KiwiOsDataUpdateCoordinator,
-#     KiwiOsSensorEntity,
-#     KiwiOsTimestampSensorEntity,
-# )
+_LOGGER = logging.getLogger(__name__)
+
+
+def device_info_from_device(device: KiwiOsDevice) -> DeviceInfo:
+    """Create the Home Assistant device info for a thing."""
+    return DeviceInfo(
+        created_at=device.created_at,
+        identifiers={(DOMAIN, device.uid)},
+        manufacturer=device.manufacturer,
+        model=device.model,
+        model_id=device.model_id,
+        name=device.name,
+        serial_number=device.serial_number,
+        sw_version=device.sw_version,
+        hw_version=device.hw_version,
+    )
+
 
-ALWAYS_INCLUDE_ID_IN_NAME = True
+def _offline_things(things: Any) -> set[str]:
+    return {
+        thing_uid
+        for thing_uid, status in parse_thing_statuses(things).items()
+        if status != THING_STATUS_ONLINE
+    }
 
 
 class KiwiOsParser:
@@ -51,10 +79,20 @@ class KiwiOsParser:
 
     def __init__(
         self,
+        timestamp_mode: str = TIMESTAMP_MODE_ENTITY,
+        channel_policy: str = CHANNEL_POLICY_DEFAULT,
+        cloud_tags: Collection[str] = (),
     ) -> None:
+        self.timestamp_mode = timestamp_mode
+        self.channel_policy = channel_policy
+        self.cloud_tags = cloud_tags
+        self._item_names: set[str] | None = None
         self._value_sensors: list[KiwiOsSensorEntity] = []
+        # Value sensors of the things that are online, the only ones parsed.
+        self._online_value_sensors: list[KiwiOsSensorEntity] = []
+        self.offline_things: set[str] = set()
         self._entities: list[SensorEntity] = []
-        pass
+        self.item_timestamps_ms: dict[str, int] = {}
 
     def parse_things(
         self, things: Any, coordinator: KiwiOsDataUpdateCoordinator
@@ -63,59 +101,72 @@ class KiwiOsParser:
         from .sensor import KiwiOsSensorEntity
 
         value_sensors: list[KiwiOsSensorEntity] = []
-        all_labels: set[str] = set()
-        duplicate_labels: set[str] = set()
-        for thing in things:
-            thing_uid = thing["UID"]
-            channels = thing.get("channels", [])
-            configuration = thing.get("configuration", {})
-            properties = thing.get("properties", {})
-
-            device_info = DeviceInfo(
-                created_at=configuration.get("dateInstallation", ""),
-                identifiers={(DOMAIN, thing_uid)},
-                manufacturer=properties.get("vendor", ""),
-                model=properties.get("modelName", ""),
-                model_id=properties.get("modelId", ""),
-                name=thing.get("label", thing_uid),
-                serial_number=properties.get("serialNumber", ""),
-                sw_version=properties.get("displaySWVersion", ""),
-                hw_version=properties.get("displayHWVersion", ""),
-            )
-
-            for channel in channels:
-                linked_items = channel.get("linkedItems", [])
-                if not linked_items:
-                    continue
-
-                label: str = channel["label"]
-                if label in all_labels:
-                    duplicate_labels.add(label)
-                all_labels.add(label)
-                value_sensor = KiwiOsSensorEntity(
-                    coordinator=coordinator,
-                    item_name=linked_items[0],
-                    item_id=channel["id"],
-                    _attr_device_info=device_info,
-                    _attr_name=label,
-                    _attr_unique_id=channel["uid"],
-                )
-                value_sensors.append(value_sensor)
-
-        for value_sensor in value_sensors:
-            if ALWAYS_INCLUDE_ID_IN_NAME or value_sensor._attr_name in duplicate_labels:
-                value_sensor._attr_name = (
-                    f"{value_sensor._attr_name} ({value_sensor.item_id})"
+        device_infos: dict[str, DeviceInfo] = {}
+        for channel in parse_channels(things, self.channel_policy, self.cloud_tags):
+            device_info = device_infos.get(channel.device.uid)
+            if device_info is None:
+                device_info = device_infos[channel.device.uid] = (
+                    device_info_from_device(channel.device)
                 )
+            value_sensor = KiwiOsSensorEntity(
+                coordinator=coordinator,
+                item_name=channel.item_name,
+                item_id=channel.id,
+                thing_uid=channel.device.uid,
+                _attr_device_info=device_info,
+                _attr_name=channel.name,
+                _attr_unique_id=channel.uid,
+            )
+            value_sensors.append(value_sensor)
 
         self._value_sensors = value_sensors
+        self._set_offline_things(_offline_things(things))
         return value_sensors
 
+    def update_thing_statuses(self, things: Any) -> bool:
+        """Mark the entities of things that are not online as unavailable.
+
+        Items of offline things are neither mapped nor parsed until their thing
+        is online again. Returns whether the status of any thing changed.
+        """
+        offline_things = _offline_things(things)
+        if offline_things == self.offline_things:
+            return False
+        for thing_uid in offline_things - self.offline_things:
+            _LOGGER.info("Thing %s is offline", thing_uid)
+        for thing_uid in self.offline_things - offline_things:
+            _LOGGER.info("Thing %s is online again", thing_uid)
+        self._set_offline_things(offline_things)
+        return True
+
+    def _set_offline_things(self, offline_things: set[str]) -> None:
+        self.offline_things = offline_things
+        online_value_sensors: list[KiwiOsSensorEntity] = []
+        for value_sensor in self._value_sensors:
+            value_sensor.online = value_sensor.thing_uid not in offline_things
+            if value_sensor.online:
+                online_value_sensors.append(value_sensor)
+            else:
+                # The last timestamp of an offline thing would look like a
+                # stalled item to the freshness tracker and the poll aligner.
+                self.item_timestamps_ms.pop(value_sensor.item_name, None)
+        self._online_value_sensors = online_value_sensors
+        self._item_names = {
+            value_sensor.item_name for value_sensor in online_value_sensors
+        }
+
+    def get_offline_item_names(self) -> set[str]:
+        """Return the names of the items of offline things."""
+        return {
+            value_sensor.item_name
+            for value_sensor in self._value_sensors
+            if not value_sensor.online
+        }
+
     def map_json_items(self, json_items: Any) -> KiwiOsApiItems:
-        items: KiwiOsApiItems = {}
-        for json_item in json_items:
-            items[json_item["name"]] = json_item
-        return items
+        # Items of channels without an entity or of offline things are not
+        # even mapped.
+        return map_json_items(json_items, self._item_names)
 
     def create_entities(
         self,
@@ -133,7 +184,10 @@ class KiwiOsParser:
 
             item = items.get(value_sensor.item_name)
             state = item.get("state", "") if item else ""
-            if "|" not in state:
+            if "|" not in state or self.timestamp_mode == TIMESTAMP_MODE_NONE:
+                continue
+            if self.timestamp_mode == TIMESTAMP_MODE_ATTRIBUTE:
+                value_sensor.timestamp_attribute = True
                 continue
 
             timestamp_sensor = KiwiOsTimestampSensorEntity(value_sensor=value_sensor)
@@ -146,119 +200,53 @@ class KiwiOsParser:
     def get_entities(self) -> list[SensorEntity]:
         return self._entities
 
+    def deselected_unique_ids(self, new_parser: KiwiOsParser) -> set[str]:
+        """Return the unique IDs of entities the options of new_parser drop.
+
+        These are the entities of channels new_parser no longer selects, and
+        all timestamp sensors if new_parser does not create timestamp entities.
+        """
+        selected = {
+            value_sensor.item_name for value_sensor in new_parser._value_sensors
+        }
+        drop_timestamps = (
+            self.timestamp_mode == TIMESTAMP_MODE_ENTITY
+            and new_parser.timestamp_mode != TIMESTAMP_MODE_ENTITY
+        )
+        unique_ids: set[str] = set()
+        for value_sensor in self._value_sensors:
+            unique_id = cast(str, value_sensor.unique_id)
+            if value_sensor.item_name not in selected:
+                unique_ids.add(unique_id)
+            if value_sensor.item_name not in selected or drop_timestamps:
+                unique_ids.add(f"{unique_id}_timestamp")
+        return unique_ids
+
     def guess_item_types(
         self,
         items: KiwiOsApiItems,
         value_sensors: list[KiwiOsSensorEntity] | None = None,
     ) -> None:
         if value_sensors is None:
-            value_sensors = self._value_sensors
+            value_sensors = self._online_value_sensors
         for entity in value_sensors:
             item = items.get(entity.item_name)
             self.guess_item_type(item, entity)
 
     def guess_item_type(self, item: Any, entity: KiwiOsSensorEntity) -> None:
-        item_state: str = item["state"]
-        item_type: str = item["type"]
-        # pattern = item["stateDescription"]["pattern"]
-        item_name: str = item["name"]
-
-        unit_string: str | None = None
-        if item_state == "UNDEF":
-            if item_type == "Number:Power":
-                unit_string = " W"
-            elif item_type == "Number:Temperature":
-                unit_string = " °C"
-            elif item_type == "Number:Energy":
-                unit_string = " Ws"  # " kWh" is also possible
-            elif item_type == "Number:ElectricPotential":
-                unit_string = " V"
-            elif item_type == "Number:ElectricCurrent":
-                unit_string = " A"
-            elif item_type == "Number:Dimensionless":
-                unit_string = " %"
-            else:
-                _LOGGER.warning(
-                    f"Unknown type: {item_type!r} with state {item_state!r}"
-                )
-        elif item_state and " " in item_state:
-            unit_string = item_state[item_state.rfind(" ") :]
-
-        if unit_string is not None:
-            entity.expected_unit_string = unit_string
-            if unit_string == " W":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = UnitOfPower.WATT
-                entity._attr_device_class = SensorDeviceClass.POWER
-                entity._attr_state_class = SensorStateClass.MEASUREMENT
-            elif unit_string == " °C":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = UnitOfTemperature.CELSIUS
-                entity._attr_device_class = SensorDeviceClass.TEMPERATURE
-                entity._attr_state_class = SensorStateClass.MEASUREMENT
-            elif unit_string == " Ws":
-                entity.conversion_factor = 1.0 / (60 * 60 * 1000)
-                entity._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-                entity._attr_device_class = SensorDeviceClass.ENERGY
-                entity._attr_state_class = SensorStateClass.TOTAL_INCREASING
-            elif unit_string == " Wh":
-                entity.conversion_factor = 1.0 / 1000
-                entity._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-                entity._attr_device_class = SensorDeviceClass.ENERGY
-                entity._attr_state_class = SensorStateClass.TOTAL_INCREASING
-            elif unit_string == " kWh":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-                entity._attr_device_class = SensorDeviceClass.ENERGY
-                entity._attr_state_class = SensorStateClass.TOTAL_INCREASING
-            elif unit_string == " V":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = UnitOfElectricPotential.VOLT
-                entity._attr_device_class = SensorDeviceClass.VOLTAGE
-                entity._attr_state_class = SensorStateClass.MEASUREMENT
-            elif unit_string == " A":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = UnitOfElectricCurrent.AMPERE
-                entity._attr_device_class = SensorDeviceClass.CURRENT
-                entity._attr_state_class = SensorStateClass.MEASUREMENT
-            elif unit_string == " %":
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = PERCENTAGE
-                if re.search("battery", item_name, re.IGNORECASE):
-                    entity._attr_device_class = SensorDeviceClass.BATTERY
-                else:
-                    entity._attr_device_class = None
-                entity._attr_state_class = SensorStateClass.MEASUREMENT
-            else:
-                _LOGGER.warning(
-                    f"Unknown unit string: {unit_string!r} for state: {item_state!r} and type {item_type!r}"
-                )
-                entity.conversion_factor = 1.0
-                entity._attr_native_unit_of_measurement = unit_string[1:]
-                entity._attr_device_class = None
-                entity._attr_state_class = None
-        elif item_type in {"Number", "String"}:
-            entity.expected_unit_string = ""
-            if item_type == "Number":
-                entity.conversion_factor = 1.0
-            else:
-                entity.conversion_factor = None
-            entity._attr_native_unit_of_measurement = None
-            entity._attr_state_class = SensorStateClass.MEASUREMENT
-            if re.search("mode", item_name, re.IGNORECASE):
-                entity._attr_device_class = SensorDeviceClass.ENUM
-            else:
-                entity._attr_device_class = None
-        else:
-            _LOGGER.warning(
-                f"Cannot guess type for state: {item_state!r} and type {item_type!r}"
-            )
-
-        if entity._attr_state_class == SensorStateClass.MEASUREMENT and (
-            re.search("total", item_name, re.IGNORECASE)
-            or re.search("total", cast(str, entity._attr_name), re.IGNORECASE)
-        ):
-            entity._attr_state_class = SensorStateClass.TOTAL
+        value_type = guess_value_type(item, cast(str, entity._attr_name))
+        entity.value_type = value_type
+        entity._attr_native_unit_of_measurement = value_type.unit
+        entity._attr_device_class = (
+            SensorDeviceClass(value_type.device_class)
+            if value_type.device_class is not None
+            else None
+        )
+        entity._attr_state_class = (
+            SensorStateClass(value_type.state_class)
+            if value_type.state_class is not None
+            else None
+        )
 
     def parse_item_values(
         self,
@@ -266,85 +254,49 @@ class KiwiOsParser:
         value_sensors: list[KiwiOsSensorEntity] | None = None,
     ) -> None:
         if value_sensors is None:
-            value_sensors = self._value_sensors
+            value_sensors = self._online_value_sensors
         for entity in value_sensors:
             item = items.get(entity.item_name)
             self.parse_item_value(item, entity)
 
+    def iter_values(self) -> Iterator[tuple[str, Any, str | None, int | None]]:
+        for entity in self._online_value_sensors:
+            yield (
+                entity.item_name,
+                entity._attr_native_value,
+                entity._attr_native_unit_of_measurement,
+                self.item_timestamps_ms.get(entity.item_name),
+            )
+
+    def parse_item_update(self, item: Any) -> bool:
+        updated = False
+        for entity in self._online_value_sensors:
+            if entity.item_name == item["name"]:
+                self.parse_item_value(item, entity)
+                updated = True
+        return updated
+
     def parse_item_value(self, item: Any, entity: KiwiOsSensorEntity) -> None:
         if entity.timestamp_sensor is not None:
             entity.timestamp_sensor._attr_native_value = None
+        entity.timestamp = None
 
         item_state = item["state"]
         if item_state == "UNDEF":
             entity._attr_native_value = None
             return
 
-        if entity.expected_unit_string == "":
-            if " " in item_state:
-                self.guess_item_type(entity, item)
-        elif not item_state.endswith(entity.expected_unit_string):
-            self.guess_item_type(entity, item)
-        assert item_state.endswith(entity.expected_unit_string)
-
-        value_str = item_state
-        if entity.expected_unit_string != "":
-            value_str = item_state[: -len(entity.expected_unit_string)]
-        if "|" in value_str:
-            assert entity.timestamp_sensor is not None
-            split = value_str.split("|")
-            value_str = split[-1]
-
-            timestamp_str = split[0].strip()
-            try:
-                timestamp_ms = int(timestamp_str)
-                dt = datetime.fromtimestamp(timestamp_ms / 1000, tz=UTC)
-                # iso_string = dt.isoformat()
-                entity.timestamp_sensor._attr_native_value = dt
-            except ValueError:
-                _LOGGER.error(
-                    f"Cannot convert timestamp string to int: {timestamp_str!r} from state: {item_state!r}"
-                )
-
-        value_str = value_str.strip()
-
-        if entity.conversion_factor is None:
-            entity._attr_native_value = value_str
-        else:
-            try:
-                entity._attr_native_value = float(value_str) * entity.conversion_factor
-            except ValueError:
-                _LOGGER.warning(
-                    f"Cannot convert value string to float: {value_str!r} from state: {item_state!r}"
-                )
-                entity._attr_native_value = value_str
-
+        if not value_type_matches(item_state, entity.value_type):
+            self.guess_item_type(item, entity)
+        value = parse_value(item_state, entity.value_type)
+        entity._attr_native_value = value.value
 
-if __name__ == "__main__":
-    parser = KiwiOsParser()
-    things = json.loads(
-        open(
-            "/workspaces/home-assistant-core/ampere-iq-smartbox-homeassistant/test_data/things.json"
-        ).read()
-    )
-    json_items = json.loads(
-        open(
-            "/workspaces/home-assistant-core/ampere-iq-smartbox-homeassistant/test_data/items.json"
-        ).read()
-    )
-    items = parser.map_json_items(json_items)
-    value_sensors = parser.parse_things(things, None)
-    entities = parser.create_entities(items, value_sensors)
-    parser.guess_item_types(items, value_sensors)
-    parser.parse_item_values(items, value_sensors)
-
-    print(
-        f"Parsed {len(entities)} entities: {len(value_sensors)} value sensors, {len(entities) - len(value_sensors)} timestamp sensors"
-    )
-    # for entity in entities:
-    #     state = None
-    #     if isinstance(entity, KiwiOsSensorEntity):
-    #         state = items.get(entity.item_name).get("state", "")
-    #     print(
-    #         f"{state!r}: {entity._attr_native_value!r}, {entity._attr_native_unit_of_measurement!r}, {entity._attr_device_class!r}, {entity._attr_state_class!r}, {entity._attr_name!r}"
-    #     )
+        timestamp_ms = value.timestamp_ms
+        if timestamp_ms is not None:
+            self.item_timestamps_ms[entity.item_name] = timestamp_ms
+            if entity.timestamp_sensor is not None or entity.timestamp_attribute:
+                dt = datetime.fromtimestamp(timestamp_ms / 1000, tz=UTC)
+                if entity.timestamp_sensor is not None:
+                    entity.timestamp_sensor._attr_native_value = dt
+                else:
+                    entity.timestamp = dt
@@ -0,0 +1,105 @@
+"""Poll scheduling aligned to the update cadence of an Ampere IQ Smartbox.
+
+The box recomputes its harmonized values on a fixed time grid and stamps them
+with the grid time, e.g. ``1760711100000|8912.5 Ws``. The period of that grid
+is the greatest common divisor of the distinct timestamps seen, its phase and
+the delay until new values are visible follow from comparing the newest
+timestamp with the time it was fetched.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Iterable
+import math
+
+MIN_PERIOD_MS = 1000
+MAX_PERIOD_MS = 60 * 60 * 1000
+MIN_DISTINCT_TIMESTAMPS = 4
+MIN_DELAY = 5.0  # seconds
+PUBLISH_MARGIN = 2.0  # seconds
+
+
+class KiwiOsPollAligner:
+    """Learns the update period and phase of a box and schedules polls after it.
+
+    Polls are scheduled just after the box publishes new values, at most
+    ``interval`` seconds apart: if the box updates faster than the poll
+    interval, every k-th update is fetched. If it updates slower, polls still
+    happen every ``interval`` seconds, because not every item carries a
+    device timestamp, and are moved to just after the update when it is due
+    within the interval.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        margin: float = PUBLISH_MARGIN,
+        history: int = 64,
+    ) -> None:
+        """Initialize the aligner.
+
+        Args:
+            interval: Nominal poll interval in seconds.
+            margin: Time in seconds to wait after new values are expected.
+            history: Number of distinct timestamps and fetches to learn from.
+        """
+        self.interval = interval
+        self.margin = margin
+        self._timestamps_ms: deque[int] = deque(maxlen=history)
+        self._lags: deque[float] = deque(maxlen=history)
+        self._newest_ms: int | None = None
+        self.period_ms: int | None = None
+
+    def observe(self, timestamps_ms: Iterable[int], fetched_at: float) -> None:
+        """Learn from the device timestamps of one poll.
+
+        Args:
+            timestamps_ms: Device timestamps of the items in epoch milliseconds.
+            fetched_at: Local epoch time in seconds at which they were fetched.
+        """
+        known = set(self._timestamps_ms)
+        newest_ms: int | None = None
+        for timestamp_ms in timestamps_ms:
+            if newest_ms is None or timestamp_ms > newest_ms:
+                newest_ms = timestamp_ms
+            if timestamp_ms not in known:
+                known.add(timestamp_ms)
+                self._timestamps_ms.append(timestamp_ms)
+        if newest_ms is None:
+            return
+
+        if self._newest_ms is None or newest_ms > self._newest_ms:
+            self._newest_ms = newest_ms
+        # The smallest lag seen is the best estimate of how long after a grid
+        # point its values become visible, including any clock offset.
+        self._lags.append(fetched_at - newest_ms / 1000)
+        self.period_ms = self._learn_period()
+
+    def _learn_period(self) -> int | None:
+        if len(self._timestamps_ms) < MIN_DISTINCT_TIMESTAMPS:
+            return None
+        timestamps_ms = sorted(self._timestamps_ms)
+        period_ms = 0
+        for previous, current in zip(timestamps_ms, timestamps_ms[1:]):
+            period_ms = math.gcd(period_ms, current - previous)
+        if not MIN_PERIOD_MS <= period_ms <= MAX_PERIOD_MS:
+            return None
+        return period_ms
+
+    def next_delay(self, now: float) -> float | None:
+        """Return the delay in seconds until the next poll should start.
+
+        Returns:
+            The delay, or None as long as the cadence of the box is unknown.
+        """
+        if self.period_ms is None or self._newest_ms is None or not self._lags:
+            return None
+        period = self.period_ms / 1000
+        visible = self._newest_ms / 1000 + min(self._lags) + self.margin
+        steps = math.floor((now - visible) / period) + 1
+        steps += max(1, math.floor(self.interval / period)) - 1
+        delay = visible + steps * period - now
+        while delay < MIN_DELAY:
+            delay += period
+        return min(delay, max(self.interval, MIN_DELAY))
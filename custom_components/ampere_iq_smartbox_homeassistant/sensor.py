@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+from collections.abc import Callable
+from datetime import datetime
+import logging
 from typing import Any
 
 from homeassistant.components.sensor import (
@@ -9,7 +12,10 @@ from homeassistant.components.sensor import (
     SensorEntity,
     SensorStateClass,
 )
+from homeassistant.const import EntityCategory, UnitOfTime
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.device_registry import DeviceInfo
 from homeassistant.helpers.entity_platform import AddConfigEntryEntitiesCallback
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
@@ -21,13 +27,21 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .__init__ import KiwiOsConfigEntry, KiwiOsData, KiwiOsDataUpdateCoordinator
     from .kiwi_os_parser import KiwiOsParser
+from .const import DOMAIN
 from .kiwi_os_api import KiwiOsApi, KiwiOsApiItems
+from .kiwi_os_core import KiwiOsValueType
+from .kiwi_os_freshness import KiwiOsFreshnessTracker
 
 # from __init__ import KiwiOsConfigEntry, KiwiOsData, KiwiOsDataUpdateCoordinator
 # from const import DOMAIN
 # from kiwi_os_api import KiwiOsApi, KiwiOsApiItems
 # from kiwi_os_parser import KiwiOsParser
 
+_LOGGER = logging.getLogger(__name__)
+# Minimum time between the state writes of a diagnostic sensor caused by its
+# listener, e.g. once per request of the box.
+LISTENER_WRITE_COOLDOWN = 1.0  # seconds
+
 
 async def async_setup_entry(
     hass: HomeAssistant,
@@ -41,19 +55,85 @@ async def async_setup_entry(
     coordinator: DataUpdateCoordinator = data.coordinator
     parser: KiwiOsParser = data.parser
 
+    freshness: KiwiOsFreshnessTracker = data.freshness
+    box_device_info = DeviceInfo(
+        identifiers={(DOMAIN, entry.entry_id)},
+        manufacturer="AMPERE",
+        model="IQ SmartBox",
+        name=entry.title,
+    )
+    diagnostic_entities: list[SensorEntity] = [
+        KiwiOsDiagnosticSensorEntity(
+            coordinator=coordinator,
+            value_fn=lambda: freshness.max_lag,
+            _attr_device_info=box_device_info,
+            _attr_name="Data lag max",
+            _attr_unique_id=f"{entry.entry_id}_data_lag_max",
+            _attr_native_unit_of_measurement=UnitOfTime.SECONDS,
+            _attr_device_class=SensorDeviceClass.DURATION,
+            _attr_state_class=SensorStateClass.MEASUREMENT,
+        ),
+        KiwiOsDiagnosticSensorEntity(
+            coordinator=coordinator,
+            value_fn=lambda: freshness.p95_lag,
+            _attr_device_info=box_device_info,
+            _attr_name="Data lag p95",
+            _attr_unique_id=f"{entry.entry_id}_data_lag_p95",
+            _attr_native_unit_of_measurement=UnitOfTime.SECONDS,
+            _attr_device_class=SensorDeviceClass.DURATION,
+            _attr_state_class=SensorStateClass.MEASUREMENT,
+        ),
+        KiwiOsDiagnosticSensorEntity(
+            coordinator=coordinator,
+            value_fn=lambda: len(freshness.stalled_items),
+            attributes_fn=lambda: {"items": freshness.stalled_items},
+            _attr_device_info=box_device_info,
+            _attr_name="Stalled items",
+            _attr_unique_id=f"{entry.entry_id}_stalled_items",
+            _attr_state_class=SensorStateClass.MEASUREMENT,
+        ),
+        KiwiOsDiagnosticSensorEntity(
+            coordinator=coordinator,
+            value_fn=lambda: api.budget.queue_depth,
+            listen_fn=api.budget.add_listener,
+            attributes_fn=lambda: {"in_flight": api.budget.in_flight},
+            _attr_device_info=box_device_info,
+            _attr_name="Request queue depth",
+            _attr_unique_id=f"{entry.entry_id}_request_queue_depth",
+            _attr_state_class=SensorStateClass.MEASUREMENT,
+        ),
+        KiwiOsDiagnosticSensorEntity(
+            coordinator=coordinator,
+            value_fn=lambda: api.budget.wait_time_avg,
+            listen_fn=api.budget.add_listener,
+            attributes_fn=lambda: {"max": api.budget.wait_time_max},
+            _attr_device_info=box_device_info,
+            _attr_name="Request wait time",
+            _attr_unique_id=f"{entry.entry_id}_request_wait_time",
+            _attr_native_unit_of_measurement=UnitOfTime.SECONDS,
+            _attr_device_class=SensorDeviceClass.DURATION,
+            _attr_state_class=SensorStateClass.MEASUREMENT,
+        ),
+    ]
+
     async_add_entities(parser.get_entities())
+    async_add_entities(diagnostic_entities)
 
 
 class KiwiOsSensorEntity(CoordinatorEntity, SensorEntity):
     """Representation of a single KiwiOs sensor entity."""
 
     _attr_has_entity_name = True
+    # The device timestamp changes with every update of the box, recording it
+    # would store a new attributes row for every state.
+    _unrecorded_attributes = frozenset({"timestamp"})
 
     def __init__(
         self,
         coordinator: KiwiOsDataUpdateCoordinator,
         item_name: str,
         item_id: str,
+        thing_uid: str,
         **kwargs,
     ) -> None:
         """Initialize a city with a name and population."""
@@ -65,9 +145,24 @@ class KiwiOsSensorEntity(CoordinatorEntity, SensorEntity):
                 raise AttributeError(f"{name!r} is not a valid attribute")
         self.item_name: str = item_name
         self.item_id: str = item_id
-        self.expected_unit_string: str = ""
-        self.conversion_factor: float | None = None
+        self.thing_uid: str = thing_uid
+        self.online: bool = True
+        self.value_type: KiwiOsValueType = KiwiOsValueType()
         self.timestamp_sensor: KiwiOsTimestampSensorEntity | None = None
+        self.timestamp_attribute: bool = False
+        self.timestamp: datetime | None = None
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return the device timestamp if it is exposed as an attribute."""
+        if not self.timestamp_attribute:
+            return None
+        return {"timestamp": self.timestamp}
+
+    @property
+    def available(self) -> bool:
+        """Return False while the thing of this item is not online."""
+        return super().available and self.online
 
     # async def async_update(self) -> None:
     #     print("KiwiOsSensorEntity.async_update", self.item_name)
@@ -104,3 +199,70 @@ class KiwiOsTimestampSensorEntity(CoordinatorEntity, SensorEntity):
         self._attr_device_info = value_sensor.device_info
         self._attr_name = f"{value_sensor._attr_name} Timestamp"
         self._attr_unique_id = f"{value_sensor._attr_unique_id}_timestamp"
+
+    @property
+    def available(self) -> bool:
+        """Return False while the thing of the value sensor is not online."""
+        return super().available and self.valueSensor.online
+
+
+class KiwiOsDiagnosticSensorEntity(CoordinatorEntity, SensorEntity):
+    """Representation of a diagnostic sensor of the box itself."""
+
+    _attr_has_entity_name = True
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    # Attributes like the list of stalled items change with every poll, those
+    # of the request budget with nearly every request.
+    _unrecorded_attributes = frozenset({"items", "in_flight", "max"})
+
+    def __init__(
+        self,
+        coordinator: KiwiOsDataUpdateCoordinator,
+        value_fn: Callable[[], Any],
+        attributes_fn: Callable[[], dict[str, Any]] | None = None,
+        listen_fn: Callable[[Callable[[], None]], Callable[[], None]] | None = None,
+        **kwargs,
+    ) -> None:
+        """Initialize a diagnostic sensor reading its value from value_fn.
+
+        If listen_fn is given, the sensor also writes its state whenever the
+        listener it registers with listen_fn is called, instead of only after
+        coordinator updates. These writes happen at most once every
+        LISTENER_WRITE_COOLDOWN seconds.
+        """
+        super().__init__(coordinator)
+        for name, value in kwargs.items():
+            if hasattr(self, name) or hasattr(type(self), name):
+                setattr(self, name, value)
+            else:
+                raise AttributeError(f"{name!r} is not a valid attribute")
+        self._value_fn = value_fn
+        self._attributes_fn = attributes_fn
+        self._listen_fn = listen_fn
+
+    async def async_added_to_hass(self) -> None:
+        """Register the listener of listen_fn."""
+        await super().async_added_to_hass()
+        if self._listen_fn is None:
+            return
+        debouncer = Debouncer(
+            self.hass,
+            _LOGGER,
+            cooldown=LISTENER_WRITE_COOLDOWN,
+            immediate=True,
+            function=self.async_write_ha_state,
+        )
+        self.async_on_remove(debouncer.async_shutdown)
+        self.async_on_remove(self._listen_fn(debouncer.async_schedule_call))
+
+    @property
+    def native_value(self) -> Any:
+        """Return the current value."""
+        return self._value_fn()
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return additional attributes, if any."""
+        if self._attributes_fn is None:
+            return None
+        return self._attributes_fn()
@@ -0,0 +1,126 @@
+"""Services for the Ampere.IQ integration."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import TYPE_CHECKING
+
+import aiohttp
+import voluptuous as vol
+
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+
+from .const import (
+    ATTR_COMMAND,
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_DURATION,
+    ATTR_ITEM,
+    ATTR_TOP,
+    DOMAIN,
+    SERVICE_MEMORY_PROFILE,
+    SERVICE_SEND_COMMAND,
+)
+from .kiwi_os_api import PasswordInvalidException, PasswordRequiredException
+from .kiwi_os_memory import MEMORY_TOP_SITES, summarize, take_snapshot
+
+if TYPE_CHECKING:
+    from . import KiwiOsConfigEntry
+
+SEND_COMMAND_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        # Item names of the box are identifiers, anything else cannot be an
+        # item and must not end up in the request path.
+        vol.Required(ATTR_ITEM): vol.All(
+            cv.string, vol.Match(r"^[A-Za-z_][A-Za-z0-9_]*$")
+        ),
+        vol.Required(ATTR_COMMAND): cv.string,
+    }
+)
+
+MEMORY_PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_DURATION, default=120): vol.All(
+            vol.Coerce(float), vol.Range(min=1, max=3600)
+        ),
+        vol.Optional(ATTR_TOP, default=MEMORY_TOP_SITES): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+    }
+)
+
+
+def _get_entry(hass: HomeAssistant, call: ServiceCall) -> KiwiOsConfigEntry:
+    entry_id: str = call.data[ATTR_CONFIG_ENTRY_ID]
+    entry = hass.config_entries.async_get_entry(entry_id)
+    if entry is None or entry.domain != DOMAIN:
+        raise ServiceValidationError(f"Config entry {entry_id!r} not found")
+    if entry.state is not ConfigEntryState.LOADED:
+        raise ServiceValidationError(f"Config entry {entry_id!r} is not loaded")
+    return entry
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the services of the integration."""
+
+    async def async_send_command(call: ServiceCall) -> ServiceResponse:
+        entry = _get_entry(hass, call)
+        item_name: str = call.data[ATTR_ITEM]
+        try:
+            item = await entry.runtime_data.commands.async_send(
+                item_name, call.data[ATTR_COMMAND]
+            )
+        except (
+            aiohttp.ClientError,
+            TimeoutError,
+            PasswordInvalidException,
+            PasswordRequiredException,
+        ) as error:
+            raise HomeAssistantError(
+                f"Cannot send command to {item_name}: {error}"
+            ) from error
+        return {"state": item.get("state")}
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SEND_COMMAND,
+        async_send_command,
+        schema=SEND_COMMAND_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    async def async_memory_profile(call: ServiceCall) -> ServiceResponse:
+        entry = _get_entry(hass, call)
+        memory = entry.runtime_data.memory
+        started = time.time()
+        with memory.profile():
+            baseline = await hass.async_add_executor_job(take_snapshot)
+            await asyncio.sleep(call.data[ATTR_DURATION])
+            snapshot = await hass.async_add_executor_job(take_snapshot)
+        integration = await hass.async_add_executor_job(
+            summarize, snapshot, baseline, call.data[ATTR_TOP]
+        )
+        return {
+            "duration": time.time() - started,
+            # The polls of this box, and the allocations of all boxes.
+            "polls": [poll for poll in memory.polls if poll["time"] >= started],
+            "integration": integration,
+        }
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_MEMORY_PROFILE,
+        async_memory_profile,
+        schema=MEMORY_PROFILE_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
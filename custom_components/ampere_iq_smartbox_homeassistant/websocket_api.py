@@ -0,0 +1,124 @@
+"""Websocket API of the Ampere.IQ integration."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any
+
+import voluptuous as vol
+
+from homeassistant.components import websocket_api
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.core import HomeAssistant, callback
+
+from .const import ATTR_CONFIG_ENTRY_ID, DOMAIN
+
+if TYPE_CHECKING:
+    from . import KiwiOsConfigEntry
+    from .kiwi_os_feed import KiwiOsFeedValues
+
+
+def async_setup_websocket_api(hass: HomeAssistant) -> None:
+    """Register the websocket commands of the integration."""
+    websocket_api.async_register_command(hass, websocket_snapshot)
+    websocket_api.async_register_command(hass, websocket_subscribe)
+
+
+def _get_entry(
+    hass: HomeAssistant, connection: websocket_api.ActiveConnection, msg: dict[str, Any]
+) -> KiwiOsConfigEntry | None:
+    entry_id: str = msg[ATTR_CONFIG_ENTRY_ID]
+    entry = hass.config_entries.async_get_entry(entry_id)
+    if (
+        entry is None
+        or entry.domain != DOMAIN
+        or entry.state is not ConfigEntryState.LOADED
+    ):
+        connection.send_error(
+            msg["id"],
+            websocket_api.ERR_NOT_FOUND,
+            f"Config entry {entry_id!r} not found or not loaded",
+        )
+        return None
+    return entry
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): f"{DOMAIN}/snapshot",
+        vol.Required(ATTR_CONFIG_ENTRY_ID): str,
+    }
+)
+@callback
+def websocket_snapshot(
+    hass: HomeAssistant, connection: websocket_api.ActiveConnection, msg: dict[str, Any]
+) -> None:
+    """Return the latest parsed values of a box."""
+    entry = _get_entry(hass, connection, msg)
+    if entry is None:
+        return
+    feed = entry.runtime_data.feed
+    connection.send_result(
+        msg["id"], {"polled_at": feed.polled_at, "values": feed.snapshot()}
+    )
+
+
+@websocket_api.websocket_command(
+    {
+        vol.Required("type"): f"{DOMAIN}/subscribe",
+        vol.Required(ATTR_CONFIG_ENTRY_ID): str,
+    }
+)
+@callback
+def websocket_subscribe(
+    hass: HomeAssistant, connection: websocket_api.ActiveConnection, msg: dict[str, Any]
+) -> None:
+    """Send the latest parsed values of a box, then those changed by each poll.
+
+    The subscription follows the config entry across reloads, e.g. after its
+    options changed: subscribers get an ``unloaded`` event when the entry is
+    unloaded and a new ``snapshot`` event once it is loaded again.
+    """
+    entry = _get_entry(hass, connection, msg)
+    if entry is None:
+        return
+    unsubscribe_feed: Callable[[], None] | None = None
+
+    @callback
+    def forward_delta(delta: KiwiOsFeedValues, polled_at: float) -> None:
+        connection.send_event(
+            msg["id"], {"type": "delta", "polled_at": polled_at, "values": delta}
+        )
+
+    @callback
+    def follow_entry() -> None:
+        nonlocal unsubscribe_feed
+        if entry.state is ConfigEntryState.LOADED:
+            if unsubscribe_feed is not None:
+                return
+            feed = entry.runtime_data.feed
+            unsubscribe_feed = feed.subscribe(forward_delta)
+            connection.send_event(
+                msg["id"],
+                {
+                    "type": "snapshot",
+                    "polled_at": feed.polled_at,
+                    "values": feed.snapshot(),
+                },
+            )
+        elif unsubscribe_feed is not None:
+            unsubscribe_feed()
+            unsubscribe_feed = None
+            connection.send_event(msg["id"], {"type": "unloaded"})
+
+    remove_state_listener = entry.async_on_state_change(follow_entry)
+
+    @callback
+    def unsubscribe() -> None:
+        remove_state_listener()
+        if unsubscribe_feed is not None:
+            unsubscribe_feed()
+
+    connection.subscriptions[msg["id"]] = unsubscribe
+    connection.send_result(msg["id"])
+    follow_entry()
@@ -1,9 +1,56 @@
 """Fixtures for testing."""
 
+from collections.abc import AsyncIterator, Awaitable, Callable
+import json
+from pathlib import Path
+from typing import Any
+
+from aiohttp import web
 import pytest
 
+DATA = Path(__file__).parent.parent / "test_data"
+
+type StandInBox = Callable[[dict[str, Callable[..., Awaitable[Any]]]], Awaitable[str]]
+
 
 @pytest.fixture(autouse=True)
 def auto_enable_custom_integrations(enable_custom_integrations):
     """Enable custom integrations."""
     return
+
+
+@pytest.fixture
+def things() -> Any:
+    """Return the /rest/things response of the test box."""
+    return json.loads((DATA / "things.json").read_text())
+
+
+@pytest.fixture
+def items() -> Any:
+    """Return the /rest/items response of the test box."""
+    return json.loads((DATA / "items.json").read_text())
+
+
+@pytest.fixture
+async def stand_in_box(socket_enabled) -> AsyncIterator[StandInBox]:
+    """Start local stand-in boxes.
+
+    The fixture is a coroutine function taking a mapping of GET paths to
+    aiohttp handlers and returning the ``host:port`` the box listens on.
+    """
+    runners: list[web.AppRunner] = []
+
+    async def start(routes: dict[str, Callable[..., Awaitable[Any]]]) -> str:
+        app = web.Application()
+        for path, handler in routes.items():
+            app.router.add_get(path, handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        runners.append(runner)
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return f"127.0.0.1:{runner.addresses[0][1]}"
+
+    yield start
+    for runner in runners:
+        await runner.cleanup()
@@ -0,0 +1,137 @@
+"""Test the per-box request budget."""
+
+import asyncio
+import gc
+import weakref
+
+import pytest
+from yarl import URL
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_budget import (
+    KiwiOsRequestBudget,
+    KiwiOsRequestPriority,
+    get_request_budget,
+)
+
+
+async def _request(
+    budget: KiwiOsRequestBudget,
+    priority: KiwiOsRequestPriority,
+    started: list,
+    duration: float = 0,
+) -> None:
+    async with budget.slot(priority):
+        started.append((asyncio.get_running_loop().time(), priority))
+        await asyncio.sleep(duration)
+
+
+async def test_priority():
+    """Test that waiting requests are served by priority, then by arrival."""
+    budget = KiwiOsRequestBudget(max_rate=1000, max_concurrency=1)
+    started: list = []
+    blocker = asyncio.ensure_future(
+        _request(budget, KiwiOsRequestPriority.USER, [], duration=0.05)
+    )
+    await asyncio.sleep(0.01)
+    priorities = [
+        KiwiOsRequestPriority.BACKGROUND,
+        KiwiOsRequestPriority.POLL,
+        KiwiOsRequestPriority.USER,
+        KiwiOsRequestPriority.WRITE,
+        KiwiOsRequestPriority.USER,
+    ]
+    tasks = []
+    for priority in priorities:
+        tasks.append(asyncio.ensure_future(_request(budget, priority, started)))
+        await asyncio.sleep(0)
+    assert budget.queue_depth == len(priorities)
+    await asyncio.gather(blocker, *tasks)
+
+    assert [priority for _, priority in started] == sorted(priorities)
+    assert budget.queue_depth == 0
+    assert budget.in_flight == 0
+
+
+async def test_rate():
+    """Test that requests start at most max_rate times per second."""
+    budget = KiwiOsRequestBudget(max_rate=20, max_concurrency=4)
+    started: list = []
+    await asyncio.gather(
+        *(_request(budget, KiwiOsRequestPriority.POLL, started) for _ in range(4))
+    )
+
+    times = [time for time, _ in started]
+    for previous, current in zip(times, times[1:]):
+        assert current - previous >= 0.05 - 0.005
+    assert budget.wait_time_max == pytest.approx(0.15, abs=0.03)
+
+
+async def test_concurrency():
+    """Test that at most max_concurrency requests are in flight."""
+    budget = KiwiOsRequestBudget(max_rate=1000, max_concurrency=2)
+    in_flight: list[int] = []
+
+    async def request() -> None:
+        async with budget.slot():
+            in_flight.append(budget.in_flight)
+            await asyncio.sleep(0.02)
+
+    await asyncio.gather(*(request() for _ in range(6)))
+    assert max(in_flight) == 2
+    assert budget.in_flight == 0
+
+
+async def test_cancellation():
+    """Test that cancelled requests neither hold nor wait for a slot."""
+    budget = KiwiOsRequestBudget(max_rate=1000, max_concurrency=1)
+    running = asyncio.ensure_future(
+        _request(budget, KiwiOsRequestPriority.POLL, [], duration=10)
+    )
+    await asyncio.sleep(0.01)
+    waiting = asyncio.ensure_future(_request(budget, KiwiOsRequestPriority.POLL, []))
+    await asyncio.sleep(0.01)
+    assert budget.in_flight == 1
+    assert budget.queue_depth == 1
+
+    waiting.cancel()
+    running.cancel()
+    await asyncio.gather(running, waiting, return_exceptions=True)
+    assert budget.in_flight == 0
+    assert budget.queue_depth == 0
+
+    started: list = []
+    await asyncio.wait_for(
+        _request(budget, KiwiOsRequestPriority.POLL, started), timeout=1
+    )
+    assert len(started) == 1
+
+
+async def test_listener():
+    """Test that listeners are called when the queue changes."""
+    budget = KiwiOsRequestBudget(max_rate=1000, max_concurrency=1)
+    depths: list[tuple[int, int]] = []
+    remove = budget.add_listener(
+        lambda: depths.append((budget.queue_depth, budget.in_flight))
+    )
+    await _request(budget, KiwiOsRequestPriority.POLL, [])
+    assert depths[0] == (0, 1)
+    assert depths[-1] == (0, 0)
+
+    remove()
+    depths.clear()
+    await _request(budget, KiwiOsRequestPriority.POLL, [])
+    assert depths == []
+
+
+def test_shared_budget():
+    """Test that requests to the same box share one budget while it is used."""
+    budget = get_request_budget(URL("http://192.0.2.1/rest"))
+    assert get_request_budget(URL("http://192.0.2.1/rest/items")) is budget
+    assert get_request_budget(URL("http://192.0.2.2/rest")) is not budget
+
+    # Budgets of hosts nobody talks to anymore, e.g. probed during a scan,
+    # are not kept.
+    reference = weakref.ref(budget)
+    del budget
+    gc.collect()
+    assert reference() is None
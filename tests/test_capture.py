@@ -0,0 +1,84 @@
+"""Test capturing, replaying and exporting raw box responses."""
+
+import copy
+import json
+
+import pytest
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_capture import (
+    KiwiOsCapture,
+    async_replay,
+    export_fixture,
+    read_capture,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_parser import (
+    KiwiOsParser,
+)
+
+POWER_OUT = "sajhybrid_powermeter_94_HSR2103J2344E27920_harmonized_power_out"
+TOTAL_IMPORT = "sajhybrid_powermeter_94_HSR2103J2344E27920_powermeter_totalImport"
+
+
+async def test_capture_round_trip(tmp_path, things, items):
+    """Test that a capture replays through the parser and exports a fixture."""
+    later_items = copy.deepcopy(items)
+    for item in later_items:
+        if item["name"] == POWER_OUT:
+            item["state"] = "1760711325000|250.0 W"
+
+    capture_path = tmp_path / "box.capture.jsonl.gz"
+    capture = KiwiOsCapture(capture_path)
+    await capture.record("/rest/things", things)
+    await capture.record("/rest/items", items)
+    await capture.record("/rest/items", later_items)
+
+    records = list(read_capture(capture_path))
+    assert [record.path for record in records] == [
+        "/rest/things",
+        "/rest/items",
+        "/rest/items",
+    ]
+    assert records[0].time <= records[1].time <= records[2].time
+
+    parser = KiwiOsParser()
+    power_out: list[float] = []
+    polls = await async_replay(
+        capture_path,
+        parser,
+        speed=0,
+        on_poll=lambda mapped: power_out.append(
+            next(
+                entity._attr_native_value
+                for entity in parser.get_entities()
+                if getattr(entity, "item_name", None) == POWER_OUT
+            )
+        ),
+    )
+    assert polls == 2
+    assert power_out == [123.5, 250.0]
+    total_import = next(
+        entity
+        for entity in parser.get_entities()
+        if getattr(entity, "item_name", None) == TOTAL_IMPORT
+    )
+    assert total_import._attr_native_value == pytest.approx(724.8903083)
+    assert total_import._attr_native_unit_of_measurement == "kWh"
+
+    fixture = tmp_path / "fixture"
+    export_fixture(capture_path, fixture, items_index=0)
+    assert json.loads((fixture / "things.json").read_text()) == things
+    assert json.loads((fixture / "items.json").read_text()) == items
+    export_fixture(capture_path, fixture)
+    assert json.loads((fixture / "items.json").read_text()) == later_items
+
+
+async def test_capture_size_cap(tmp_path, items):
+    """Test that nothing is recorded once the capture reached its size."""
+    capture_path = tmp_path / "box.capture.jsonl.gz"
+    capture = KiwiOsCapture(capture_path, max_bytes=1)
+    await capture.record("/rest/items", items)
+    await capture.record("/rest/items", items)
+
+    assert len(list(read_capture(capture_path))) == 1
+    with pytest.raises(ValueError):
+        export_fixture(capture_path, tmp_path / "fixture")
@@ -0,0 +1,186 @@
+"""Test the command queue for writable items."""
+
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+import pytest
+import voluptuous as vol
+from yarl import URL
+
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from custom_components.ampere_iq_smartbox_homeassistant.const import DOMAIN
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_api import (
+    KiwiOsApi,
+    KiwiOsCommandQueue,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_budget import (
+    KiwiOsRequestBudget,
+)
+
+
+class _Box:
+    """API stand-in recording the commands it receives."""
+
+    def __init__(self) -> None:
+        self.states: dict[str, str] = {}
+        self.writes: list[tuple[float, str, str]] = []
+        self.fail = False
+
+    async def send_command(self, item_name: str, command: str) -> None:
+        await asyncio.sleep(0)
+        if self.fail:
+            raise aiohttp.ClientError("box is gone")
+        self.writes.append((asyncio.get_running_loop().time(), item_name, command))
+        self.states[item_name] = command
+
+    async def get_item(self, item_name: str, priority=None) -> dict[str, str]:
+        await asyncio.sleep(0)
+        return {"name": item_name, "state": self.states[item_name]}
+
+
+async def test_coalescing():
+    """Test that queued commands for the same item only send the latest one."""
+    box = _Box()
+    queue = KiwiOsCommandQueue(box, interval=0)
+    results = await asyncio.gather(
+        queue.async_send("mode", "1"),
+        queue.async_send("mode", "2"),
+        queue.async_send("limit", "500"),
+        queue.async_send("mode", "3"),
+    )
+
+    assert [(item, command) for _, item, command in box.writes] == [
+        ("mode", "3"),
+        ("limit", "500"),
+    ]
+    assert [result["state"] for result in results] == ["3", "3", "500", "3"]
+    assert queue.pending_count() == 0
+
+
+async def test_interval():
+    """Test that writes are spaced by the interval."""
+    box = _Box()
+    queue = KiwiOsCommandQueue(box, interval=0.05)
+    await asyncio.gather(
+        queue.async_send("a", "1"),
+        queue.async_send("b", "1"),
+        queue.async_send("c", "1"),
+    )
+
+    times = [write_time for write_time, _, _ in box.writes]
+    assert len(times) == 3
+    for previous, current in zip(times, times[1:]):
+        assert current - previous >= 0.05 - 0.005
+
+
+async def test_acknowledgement():
+    """Test that every write is acknowledged with the re-read item."""
+    box = _Box()
+    acknowledged: list[dict[str, str]] = []
+    queue = KiwiOsCommandQueue(
+        box, interval=0, acknowledged_callback=acknowledged.append
+    )
+
+    assert await queue.async_send("mode", "1") == {"name": "mode", "state": "1"}
+    assert acknowledged == [{"name": "mode", "state": "1"}]
+
+
+async def test_acknowledgement_error():
+    """Test that callers get the item even if the acknowledgement fails."""
+
+    def acknowledged(item):
+        raise ValueError("cannot parse")
+
+    box = _Box()
+    queue = KiwiOsCommandQueue(box, interval=0, acknowledged_callback=acknowledged)
+
+    item = await asyncio.wait_for(queue.async_send("mode", "1"), timeout=1)
+    assert item == {"name": "mode", "state": "1"}
+    item = await asyncio.wait_for(queue.async_send("mode", "2"), timeout=1)
+    assert item == {"name": "mode", "state": "2"}
+
+
+async def test_write_error():
+    """Test that a failed write fails its callers, but not later commands."""
+    box = _Box()
+    queue = KiwiOsCommandQueue(box, interval=0)
+    box.fail = True
+    with pytest.raises(aiohttp.ClientError):
+        await queue.async_send("mode", "1")
+    box.fail = False
+    assert (await queue.async_send("mode", "2"))["state"] == "2"
+
+
+async def test_close():
+    """Test that closing the queue cancels the waiting callers."""
+    box = _Box()
+    queue = KiwiOsCommandQueue(box, interval=10)
+    await queue.async_send("a", "1")
+    waiting = asyncio.ensure_future(queue.async_send("b", "1"))
+    await asyncio.sleep(0.01)
+    queue.close()
+
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert [item for _, item, _ in box.writes] == ["a"]
+
+
+async def test_item_path_quoted(hass, stand_in_box):
+    """Test that item names cannot change the request path."""
+    paths: list[str] = []
+
+    async def get_item(request):
+        paths.append(request.raw_path)
+        return web.json_response({"name": request.match_info["name"]})
+
+    host = await stand_in_box({"/rest/items/{name}": get_item})
+    api = KiwiOsApi(
+        url=URL(f"http://{host}"),
+        session=async_get_clientsession(hass),
+        budget=KiwiOsRequestBudget(max_rate=100),
+    )
+    assert await api.get_item("a/../b?c") == {"name": "a/../b?c"}
+    assert paths == ["/rest/items/a%2F..%2Fb%3Fc"]
+
+
+async def test_send_command_service(hass, stand_in_box, things, items):
+    """Test that the service rejects invalid items and wraps box errors."""
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False},
+        title="Box",
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    with pytest.raises(vol.Invalid):
+        await hass.services.async_call(
+            DOMAIN,
+            "send_command",
+            {"config_entry_id": entry.entry_id, "item": "..", "command": "1"},
+            blocking=True,
+        )
+    # The stand-in box does not accept writes.
+    with pytest.raises(HomeAssistantError, match="Cannot send command"):
+        await hass.services.async_call(
+            DOMAIN,
+            "send_command",
+            {"config_entry_id": entry.entry_id, "item": "mode", "command": "1"},
+            blocking=True,
+        )
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
@@ -0,0 +1,131 @@
+"""Test the config flow against local stand-in boxes."""
+
+from unittest.mock import patch
+
+from aiohttp import web
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from homeassistant.data_entry_flow import FlowResultType
+from homeassistant.helpers import aiohttp_client
+
+from custom_components.ampere_iq_smartbox_homeassistant.const import DOMAIN
+
+
+async def _rest(request):
+    return web.json_response({"version": "4", "links": []})
+
+
+async def test_scan_and_pick(hass, stand_in_box):
+    """Test that a scan lists the new boxes only and creates the picked one."""
+    configured = await stand_in_box({"/rest": _rest})
+    new = await stand_in_box({"/rest": _rest})
+    MockConfigEntry(
+        domain=DOMAIN,
+        unique_id=f"http://{configured}",
+        data={"url": f"http://{configured}", "password": ""},
+    ).add_to_hass(hass)
+
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": "user"}
+    )
+    assert result["type"] is FlowResultType.MENU
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"next_step_id": "scan"}
+    )
+    assert result["step_id"] == "scan"
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"hosts": f"{configured}, {new}, 127.0.0.1:1"}
+    )
+    assert result["step_id"] == "pick"
+    assert result["data_schema"].schema["url"].container == [f"http://{new}"]
+
+    with patch(
+        "custom_components.ampere_iq_smartbox_homeassistant.async_setup_entry",
+        return_value=True,
+    ):
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"], {"url": f"http://{new}", "password": ""}
+        )
+        await hass.async_block_till_done()
+    assert result["type"] is FlowResultType.CREATE_ENTRY
+    assert result["result"].unique_id == f"http://{new}"
+    assert result["data"]["url"] == f"http://{new}"
+    assert result["options"] == {"channel_policy": "cloud_mapped"}
+
+
+async def test_scan_nothing_new(hass, stand_in_box):
+    """Test that a scan finding only configured boxes shows an error."""
+    configured = await stand_in_box({"/rest": _rest})
+    MockConfigEntry(
+        domain=DOMAIN, data={"url": f"http://{configured}", "password": ""}
+    ).add_to_hass(hass)
+
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": "user"}
+    )
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"next_step_id": "scan"}
+    )
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"hosts": configured}
+    )
+    assert result["type"] is FlowResultType.FORM
+    assert result["errors"] == {"base": "no_devices_found"}
+
+
+async def test_manual_already_configured(hass, stand_in_box):
+    """Test that the same box cannot be added twice, with or without unique ID."""
+    host = await stand_in_box({"/rest": _rest})
+    MockConfigEntry(
+        domain=DOMAIN, data={"url": f"http://{host}", "password": ""}
+    ).add_to_hass(hass)
+
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": "user"}
+    )
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"next_step_id": "manual"}
+    )
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"url": f"{host}/", "password": ""}
+    )
+    assert result["type"] is FlowResultType.ABORT
+    assert result["reason"] == "already_configured"
+
+
+async def test_manual_retry(hass, stand_in_box):
+    """Test that retries of the manual step share the session of the flow."""
+    box_up = False
+
+    async def rest(request):
+        if not box_up:
+            raise web.HTTPServiceUnavailable
+        return await _rest(request)
+
+    host = await stand_in_box({"/rest": rest})
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": "user"}
+    )
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"], {"next_step_id": "manual"}
+    )
+    with patch(
+        "custom_components.ampere_iq_smartbox_homeassistant.config_flow"
+        ".aiohttp_client.async_create_clientsession",
+        wraps=aiohttp_client.async_create_clientsession,
+    ) as create_session:
+        result = await hass.config_entries.flow.async_configure(
+            result["flow_id"], {"url": host, "password": ""}
+        )
+        assert result["errors"] == {"base": "unexpected_response"}
+        box_up = True
+        with patch(
+            "custom_components.ampere_iq_smartbox_homeassistant.async_setup_entry",
+            return_value=True,
+        ):
+            result = await hass.config_entries.flow.async_configure(
+                result["flow_id"], {"url": host, "password": ""}
+            )
+            await hass.async_block_till_done()
+    assert result["type"] is FlowResultType.CREATE_ENTRY
+    assert create_session.call_count == 1
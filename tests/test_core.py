@@ -0,0 +1,85 @@
+"""Test the Home Assistant free parser core."""
+
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from custom_components.ampere_iq_smartbox_homeassistant import kiwi_os_core
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_core import (
+    CHANNEL_POLICY_ALL,
+    CHANNEL_POLICY_CLOUD_MAPPED,
+    map_json_items,
+    parse_channels,
+    parse_snapshot,
+)
+
+TOTAL_IMPORT = "sajhybrid_powermeter_94_HSR2103J2344E27920_powermeter_totalImport"
+CORE = Path(kiwi_os_core.__file__)
+DATA = Path(__file__).parent.parent / "test_data"
+POWER_OUT = "sajhybrid_powermeter_94_HSR2103J2344E27920_harmonized_power_out"
+POWER_LIMIT = "sajhybrid_inverter_94_HSR2103J2344E27920_controlling_powerAcOutLimit"
+
+
+def test_run_as_script():
+    """Test running the core as a script to audit a capture directory."""
+    result = subprocess.run(
+        [sys.executable, str(CORE), "--policy", CHANNEL_POLICY_ALL, str(DATA)],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert result.returncode == 0, result.stderr
+    summary = json.loads(result.stdout)
+    assert summary["channels"] == 99
+    assert summary["units"]["kWh"] > 0
+
+
+def test_import_without_home_assistant():
+    """Test that importing the core on its own does not load Home Assistant."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "sys.path.insert(0, sys.argv[1])\n"
+            "import kiwi_os_core\n"
+            "print(sorted(name for name in sys.modules"
+            " if name.split('.')[0] == 'homeassistant'))",
+            str(CORE.parent),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_parse_snapshot(things, items):
+    """Test parsing the values and units of the test box."""
+    assert len(parse_channels(things)) == 99
+    channels = parse_channels(things, CHANNEL_POLICY_CLOUD_MAPPED)
+    assert len(channels) == 48
+
+    values = {
+        channel.item_name: value
+        for channel, value in parse_snapshot(
+            channels, map_json_items(items, {c.item_name for c in channels})
+        )
+    }
+    assert len(values) == 48
+
+    # Ws are converted to kWh.
+    assert values[TOTAL_IMPORT].value == pytest.approx(2.60960511e9 / 3600000)
+    assert values[TOTAL_IMPORT].unit == "kWh"
+    assert values[TOTAL_IMPORT].timestamp_ms is None
+
+    # Harmonized items carry their device timestamp.
+    assert values[POWER_OUT].value == 123.5
+    assert values[POWER_OUT].unit == "W"
+    assert values[POWER_OUT].timestamp_ms == 1760711265000
+
+    assert values[POWER_LIMIT].value is None
+    assert values[POWER_LIMIT].unit == "W"
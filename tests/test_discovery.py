@@ -0,0 +1,71 @@
+"""Test LAN discovery against local stand-in boxes."""
+
+import asyncio
+
+from aiohttp import web
+import pytest
+from yarl import URL
+
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_budget import (
+    get_request_budget,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_discovery import (
+    async_discover,
+    async_probe,
+    expand_hosts,
+)
+
+
+async def _open_box(request):
+    return web.json_response({"version": "4", "links": []})
+
+
+async def _protected_box(request):
+    raise web.HTTPFound("/logon.html")
+
+
+async def _other_server(request):
+    return web.Response(status=404)
+
+
+def test_expand_hosts():
+    """Test expanding subnets and host lists."""
+    assert expand_hosts("10.0.0.0/30, box.local 10.0.0.1") == [
+        "10.0.0.1",
+        "10.0.0.2",
+        "box.local",
+    ]
+    assert len(expand_hosts("192.168.1.0/24")) == 254
+    with pytest.raises(ValueError):
+        expand_hosts("10.0.0.0/8")
+
+
+async def test_async_discover(hass, stand_in_box):
+    """Test that only hosts answering like a box are found."""
+    hosts = [
+        await stand_in_box({"/rest": handler})
+        for handler in (_open_box, _protected_box, _other_server)
+    ]
+    found = await async_discover(
+        async_get_clientsession(hass), [*hosts, "127.0.0.1:1"], timeout=1
+    )
+
+    assert [str(url) for url in found] == [
+        f"http://{hosts[0]}",
+        f"http://{hosts[1]}",
+    ]
+
+
+async def test_probe_timeout_includes_budget(hass, stand_in_box):
+    """Test that a probe waiting for a busy budget times out."""
+    url = URL(f"http://{await stand_in_box({'/rest': _open_box})}")
+    budget = get_request_budget(url)
+    budget.configure(budget.max_rate, 1)
+    async with budget.slot():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        assert not await async_probe(async_get_clientsession(hass), url, timeout=0.2)
+        assert loop.time() - start < 1
+    assert budget.queue_depth == 0
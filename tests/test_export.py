@@ -0,0 +1,104 @@
+"""Test the columnar export of polled values."""
+
+import asyncio
+from collections.abc import Callable
+import gzip
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_export import (
+    KiwiOsColumnarExporter,
+)
+
+POLLED_AT = 1760711300.5
+TIMESTAMP_MS = 1760711265000
+
+
+async def _executor(function: Callable[..., Any], *args: Any) -> Any:
+    return function(*args)
+
+
+def _read(directory: Path) -> list[dict[str, list[Any]]]:
+    (path,) = directory.glob("*.jsonl.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+async def test_export(tmp_path):
+    """Test that device timestamps are exported once, poll times every poll."""
+    exporter = KiwiOsColumnarExporter(tmp_path, _executor)
+    for poll in range(3):
+        exporter.append(
+            POLLED_AT + poll * 60,
+            [
+                ("power", 123.5, "W", TIMESTAMP_MS + (poll // 2) * 300000),
+                ("energy", 724.9, "kWh", None),
+                ("limit", None, "W", None),
+            ],
+        )
+    assert exporter.buffered_rows == 5
+    await exporter.async_flush()
+    assert exporter.buffered_rows == 0
+
+    assert _read(tmp_path) == [
+        {
+            "timestamp": [
+                TIMESTAMP_MS,
+                1760711300500,
+                1760711360500,
+                TIMESTAMP_MS + 300000,
+                1760711420500,
+            ],
+            "source": ["device", "poll", "poll", "device", "poll"],
+            "item": ["power", "energy", "energy", "power", "energy"],
+            "value": [123.5, 724.9, 724.9, 123.5, 724.9],
+            "unit": ["W", "kWh", "kWh", "W", "kWh"],
+        }
+    ]
+
+
+async def test_max_rows(tmp_path):
+    """Test that the oldest rows are dropped when the buffer is full."""
+    exporter = KiwiOsColumnarExporter(tmp_path, _executor, flush_rows=2, max_rows=2)
+    for poll in range(5):
+        exporter.append(POLLED_AT + poll, [("energy", poll, "kWh", None)])
+    assert exporter.buffered_rows == 2
+    assert exporter.dropped_rows == 3
+    assert exporter.flush_due(POLLED_AT + 1)
+
+    await exporter.async_flush()
+    assert _read(tmp_path)[0]["value"] == [3, 4]
+
+
+async def test_flush_failure(tmp_path):
+    """Test that the rows of a failed or cancelled write are put back."""
+    failure: type[BaseException] | None = OSError
+
+    async def failing_executor(function: Callable[..., Any], *args: Any) -> Any:
+        if failure is not None:
+            raise failure
+        return function(*args)
+
+    exporter = KiwiOsColumnarExporter(tmp_path, failing_executor, max_rows=3)
+    exporter.append(POLLED_AT, [("energy", 0, "kWh", None)])
+    await exporter.async_flush()
+    assert exporter.buffered_rows == 1
+    assert exporter.flush_due(POLLED_AT + exporter.flush_interval)
+
+    failure = asyncio.CancelledError
+    exporter.append(POLLED_AT + 1, [("energy", 1, "kWh", None)])
+    with pytest.raises(asyncio.CancelledError):
+        await exporter.async_flush()
+    assert exporter.buffered_rows == 2
+
+    # Put back rows count against the buffer limit.
+    for poll in range(2, 4):
+        exporter.append(POLLED_AT + poll, [("energy", poll, "kWh", None)])
+    assert exporter.dropped_rows == 1
+
+    failure = None
+    await exporter.async_flush()
+    assert _read(tmp_path)[0]["value"] == [1, 2, 3]
@@ -0,0 +1,59 @@
+"""Test the data freshness tracking."""
+
+import pytest
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_freshness import (
+    KiwiOsFreshnessTracker,
+)
+
+START_MS = 1760711100000
+
+
+def test_lag_of_advanced_timestamps():
+    """Test that only new timestamps add lag samples."""
+    tracker = KiwiOsFreshnessTracker()
+    assert tracker.max_lag is None
+    assert tracker.p95_lag is None
+
+    tracker.record({"a": START_MS, "b": START_MS}, START_MS / 1000 + 2)
+    # Polled again before the box published new values.
+    for poll in range(1, 100):
+        tracker.record({"a": START_MS, "b": START_MS}, START_MS / 1000 + 2 + poll)
+    tracker.record({"a": START_MS + 300000, "b": START_MS}, START_MS / 1000 + 304)
+
+    assert tracker.max_lag == pytest.approx(4)
+    assert tracker.p95_lag == pytest.approx(4)
+
+
+def test_p95_lag():
+    """Test the 95th percentile of the lag."""
+    tracker = KiwiOsFreshnessTracker()
+    for index in range(100):
+        timestamp_ms = START_MS + index * 60000
+        tracker.record({"a": timestamp_ms}, timestamp_ms / 1000 + index / 10)
+
+    assert tracker.max_lag == pytest.approx(9.9)
+    assert tracker.p95_lag == pytest.approx(9.4)
+
+
+def test_stalled_items():
+    """Test that items whose timestamp does not advance count as stalled."""
+    tracker = KiwiOsFreshnessTracker(stall_timeout=600)
+    assert tracker.stalled_items == []
+    for minute in range(12):
+        tracker.record(
+            {"a": START_MS + minute * 60000, "b": START_MS},
+            START_MS / 1000 + minute * 60 + 2,
+        )
+
+    assert tracker.stalled_items == ["b"]
+
+
+def test_forget_missing_items():
+    """Test that items no longer recorded, e.g. of offline things, are dropped."""
+    tracker = KiwiOsFreshnessTracker(stall_timeout=600)
+    tracker.record({"a": START_MS, "b": START_MS}, START_MS / 1000 + 2)
+    for minute in range(1, 12):
+        tracker.record({"a": START_MS + minute * 60000}, START_MS / 1000 + minute * 60)
+
+    assert tracker.stalled_items == []
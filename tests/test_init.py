@@ -1,9 +1,255 @@
 """Test component setup."""
+
+from datetime import timedelta
+from pathlib import Path
+
+from aiohttp import web
+from pytest_homeassistant_custom_component.common import (
+    MockConfigEntry,
+    async_capture_events,
+    async_fire_time_changed,
+)
+
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.helpers import entity_registry as er
 from homeassistant.setup import async_setup_component
+from homeassistant.util import dt as dt_util
 
 from custom_components.ampere_iq_smartbox_homeassistant.const import DOMAIN
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_capture import (
+    read_capture,
+)
 
 
 async def test_async_setup(hass):
     """Test the component gets setup."""
     assert await async_setup_component(hass, DOMAIN, {}) is True
+
+
+def _value_entries(
+    entity_registry: er.EntityRegistry, entry: MockConfigEntry
+) -> list[er.RegistryEntry]:
+    return [
+        registry_entry
+        for registry_entry in er.async_entries_for_config_entry(
+            entity_registry, entry.entry_id
+        )
+        if registry_entry.entity_category is None
+        and not registry_entry.unique_id.endswith("_timestamp")
+    ]
+
+
+async def _setup_entry(
+    hass, stand_in_box, things, items, options: dict | None = None
+) -> MockConfigEntry:
+    """Set up an entry for a stand-in box serving things and items."""
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False, **(options or {})},
+        title="Box",
+        minor_version=2,
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    return entry
+
+
+def _timestamp_entries(
+    entity_registry: er.EntityRegistry, entry: MockConfigEntry
+) -> list[er.RegistryEntry]:
+    return [
+        registry_entry
+        for registry_entry in er.async_entries_for_config_entry(
+            entity_registry, entry.entry_id
+        )
+        if registry_entry.unique_id.endswith("_timestamp")
+    ]
+
+
+async def test_channel_policy_migration(hass, stand_in_box, things, items):
+    """Test that existing entries keep all channels until the user changes it."""
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False},
+        title="Box",
+        version=1,
+        minor_version=1,
+    )
+    entry.add_to_hass(hass)
+    entity_registry = er.async_get(hass)
+    orphan = entity_registry.async_get_or_create(
+        "sensor", DOMAIN, "orphan", config_entry=entry
+    )
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    assert entry.minor_version == 2
+    assert entry.options["channel_policy"] == "all"
+    # 99 channels and the orphan.
+    assert len(_value_entries(entity_registry, entry)) == 99 + 1
+
+    # A new session id does not reload the entry.
+    runtime_data = entry.runtime_data
+    hass.config_entries.async_update_entry(
+        entry, data={**entry.data, "kiwisessionid": "new"}
+    )
+    await hass.async_block_till_done()
+    assert entry.runtime_data is runtime_data
+
+    hass.config_entries.async_update_entry(
+        entry, options={**entry.options, "channel_policy": "cloud_mapped"}
+    )
+    await hass.async_block_till_done()
+    assert entry.runtime_data is not runtime_data
+    # Only the deselected channels are removed, not the orphan.
+    assert len(_value_entries(entity_registry, entry)) == 48 + 1
+    assert entity_registry.async_get(orphan.entity_id) is not None
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
+
+
+async def test_timestamp_mode_change(hass, stand_in_box, things, items):
+    """Test that turning off timestamp entities removes them from the registry."""
+    entry = await _setup_entry(
+        hass, stand_in_box, things, items, {"timestamp_mode": "entity"}
+    )
+
+    entity_registry = er.async_get(hass)
+    value_entries = _value_entries(entity_registry, entry)
+    assert len(_timestamp_entries(entity_registry, entry)) > 0
+
+    hass.config_entries.async_update_entry(
+        entry, options={**entry.options, "timestamp_mode": "attribute"}
+    )
+    await hass.async_block_till_done()
+    assert _timestamp_entries(entity_registry, entry) == []
+    assert _value_entries(entity_registry, entry) == value_entries
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
+
+
+async def test_failed_poll_interval(hass, stand_in_box, things, items):
+    """Test that failed polls are retried at the normal interval."""
+    box_up = True
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        if not box_up:
+            raise web.HTTPServiceUnavailable
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": True},
+        title="Box",
+        minor_version=2,
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    coordinator = entry.runtime_data.coordinator
+    coordinator.update_interval = timedelta(seconds=5)
+    box_up = False
+    await coordinator.async_refresh()
+    assert not coordinator.last_update_success
+    assert coordinator.update_interval == timedelta(seconds=60)
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
+
+
+async def test_budget_sensor_throttle(hass, stand_in_box, things, items):
+    """Test that the budget sensors do not write their state on every request."""
+    entry = await _setup_entry(hass, stand_in_box, things, items)
+    entity_id = er.async_get(hass).async_get_entity_id(
+        "sensor", DOMAIN, f"{entry.entry_id}_request_queue_depth"
+    )
+    # Let the cooldown of the requests made during setup pass.
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=2))
+    await hass.async_block_till_done()
+
+    events = async_capture_events(hass, EVENT_STATE_CHANGED)
+    budget = entry.runtime_data.api.budget
+    for _ in range(10):
+        budget.in_flight += 1
+        budget.configure(budget.max_rate, budget.max_concurrency)
+    await hass.async_block_till_done()
+    changes = [event for event in events if event.data["entity_id"] == entity_id]
+    assert len(changes) == 1
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=2))
+    await hass.async_block_till_done()
+    changes = [event for event in events if event.data["entity_id"] == entity_id]
+    assert len(changes) == 2
+    assert changes[-1].data["new_state"].attributes["in_flight"] == budget.in_flight
+
+    budget.in_flight -= 10
+    assert await hass.config_entries.async_unload(entry.entry_id)
+
+
+async def test_thing_status_check(hass, stand_in_box, things, items):
+    """Test that offline things are found from uncaptured thing summaries."""
+    summaries = [
+        {**thing, "channels": [], "statusInfo": {"status": "OFFLINE"}}
+        for thing in things
+    ]
+    queries = []
+
+    async def get_things(request):
+        queries.append(dict(request.query))
+        if request.query.get("summary") == "true":
+            return web.json_response(summaries)
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False, "capture": True},
+        title="Box",
+        minor_version=2,
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    feed = entry.runtime_data.feed
+    assert any(value["value"] is not None for value in feed.snapshot().values())
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(minutes=5))
+    await hass.async_block_till_done(wait_background_tasks=True)
+    assert queries == [{}, {"summary": "true"}]
+    # The values of offline things are no longer served.
+    assert feed.snapshot()
+    assert all(value["value"] is None for value in feed.snapshot().values())
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
+    capture_path = Path(hass.config.path(DOMAIN, f"{entry.entry_id}.capture.jsonl.gz"))
+    assert [record.path for record in read_capture(capture_path)].count(
+        "/rest/things"
+    ) == 1
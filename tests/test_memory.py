@@ -0,0 +1,77 @@
+"""Test the memory profiling."""
+
+import tracemalloc
+
+from aiohttp import web
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.ampere_iq_smartbox_homeassistant.const import DOMAIN
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_memory import (
+    KiwiOsMemoryProfiler,
+)
+
+
+def test_measure_poll():
+    """Test that polls are only measured while a profile is running."""
+    tracing = tracemalloc.is_tracing()
+    profiler = KiwiOsMemoryProfiler()
+    with profiler.measure_poll():
+        pass
+    assert not profiler.polls
+
+    kept = []
+    with profiler.profile():
+        with profiler.measure_poll():
+            kept.append(bytearray(100000))
+            kept.append([object() for _ in range(100)])
+    assert tracemalloc.is_tracing() == tracing
+
+    (poll,) = profiler.polls
+    assert poll["retained_size"] >= 100000
+    assert poll["peak_size"] >= poll["retained_size"]
+    assert poll["retained_blocks"] >= 100
+
+
+async def test_memory_profile_service(hass, stand_in_box, things, items):
+    """Test that the service returns the polls and allocations of a profile."""
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False},
+        title="Box",
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    tracing = tracemalloc.is_tracing()
+
+    profile = hass.async_create_task(
+        hass.services.async_call(
+            DOMAIN,
+            "memory_profile",
+            {"config_entry_id": entry.entry_id, "duration": 1, "top": 3},
+            blocking=True,
+            return_response=True,
+        )
+    )
+    await entry.runtime_data.coordinator.async_refresh()
+    result = await profile
+    assert tracemalloc.is_tracing() == tracing
+
+    assert result["duration"] >= 1
+    (poll,) = result["polls"]
+    assert poll["duration"] > 0
+    integration = result["integration"]
+    assert integration["traced_size"] > 0
+    assert integration["traced_blocks"] > 0
+    assert 0 < len(integration["top_sites"]) <= 3
+
+    assert await hass.config_entries.async_unload(entry.entry_id)
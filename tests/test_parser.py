@@ -0,0 +1,120 @@
+"""Test the Home Assistant adapter of the parser."""
+
+import copy
+from datetime import UTC, datetime
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from custom_components.ampere_iq_smartbox_homeassistant.const import (
+    TIMESTAMP_MODE_ATTRIBUTE,
+    TIMESTAMP_MODE_ENTITY,
+    TIMESTAMP_MODE_NONE,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_parser import (
+    KiwiOsParser,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.sensor import (
+    KiwiOsSensorEntity,
+    KiwiOsTimestampSensorEntity,
+)
+
+POWERMETER = "sajhybrid:powermeter:94-HSR2103J2344E27920"
+POWER_OUT = "sajhybrid_powermeter_94_HSR2103J2344E27920_harmonized_power_out"
+POWER_OUT_TIMESTAMP = datetime(2025, 10, 17, 14, 27, 45, tzinfo=UTC)
+
+
+def _create_parser(
+    hass: HomeAssistant, things: Any, items: Any, **kwargs: Any
+) -> tuple[KiwiOsParser, dict[str, KiwiOsSensorEntity]]:
+    coordinator = DataUpdateCoordinator(hass, None, config_entry=None, name="test")
+    parser = KiwiOsParser(**kwargs)
+    value_sensors = parser.parse_things(things, coordinator)
+    mapped_items = parser.map_json_items(items)
+    parser.create_entities(mapped_items)
+    parser.guess_item_types(mapped_items)
+    parser.parse_item_values(mapped_items)
+    return parser, {
+        value_sensor.item_name: value_sensor for value_sensor in value_sensors
+    }
+
+
+def _with_status(things: Any, thing_uid: str, status: str) -> Any:
+    things = copy.deepcopy(things)
+    for thing in things:
+        if thing["UID"] == thing_uid:
+            thing["statusInfo"]["status"] = status
+    return things
+
+
+async def test_offline_things(hass, things, items):
+    """Test that the items of offline things are neither parsed nor published."""
+    parser, value_sensors = _create_parser(hass, things, items)
+    assert POWER_OUT in parser.item_timestamps_ms
+    assert POWER_OUT in {item_name for item_name, *_ in parser.iter_values()}
+
+    assert not parser.update_thing_statuses(things)
+    assert parser.update_thing_statuses(_with_status(things, POWERMETER, "OFFLINE"))
+    assert parser.offline_things == {POWERMETER}
+    powermeter = [s for s in value_sensors.values() if s.thing_uid == POWERMETER]
+    assert powermeter
+    assert not any(value_sensor.online for value_sensor in powermeter)
+    assert not any(value_sensor.available for value_sensor in powermeter)
+
+    item_names = {value_sensor.item_name for value_sensor in powermeter}
+    assert not item_names & parser.map_json_items(items).keys()
+    parser.parse_item_values(parser.map_json_items(items))
+    assert not item_names & parser.item_timestamps_ms.keys()
+    assert not item_names & {item_name for item_name, *_ in parser.iter_values()}
+    assert parser.item_timestamps_ms
+
+    assert parser.update_thing_statuses(things)
+    parser.parse_item_values(parser.map_json_items(items))
+    assert POWER_OUT in parser.item_timestamps_ms
+    assert all(value_sensor.online for value_sensor in powermeter)
+
+
+async def test_timestamp_entities(hass, things, items):
+    """Test that timestamped items get a timestamp sensor in entity mode."""
+    parser, value_sensors = _create_parser(
+        hass, things, items, timestamp_mode=TIMESTAMP_MODE_ENTITY
+    )
+    timestamp_sensor = value_sensors[POWER_OUT].timestamp_sensor
+    assert timestamp_sensor in parser.get_entities()
+    assert timestamp_sensor.native_value == POWER_OUT_TIMESTAMP
+    assert (
+        timestamp_sensor.unique_id == f"{value_sensors[POWER_OUT].unique_id}_timestamp"
+    )
+    assert value_sensors[POWER_OUT].extra_state_attributes is None
+
+
+async def test_timestamp_attribute(hass, things, items):
+    """Test that attribute mode exposes an unrecorded timestamp attribute."""
+    parser, value_sensors = _create_parser(
+        hass, things, items, timestamp_mode=TIMESTAMP_MODE_ATTRIBUTE
+    )
+    assert not any(
+        isinstance(entity, KiwiOsTimestampSensorEntity)
+        for entity in parser.get_entities()
+    )
+    value_sensor = value_sensors[POWER_OUT]
+    assert value_sensor.timestamp_sensor is None
+    assert value_sensor.extra_state_attributes == {"timestamp": POWER_OUT_TIMESTAMP}
+    assert "timestamp" in value_sensor._unrecorded_attributes
+
+
+async def test_timestamp_none(hass, things, items):
+    """Test that none mode neither converts nor exposes the timestamps."""
+    parser, value_sensors = _create_parser(
+        hass, things, items, timestamp_mode=TIMESTAMP_MODE_NONE
+    )
+    assert not any(
+        isinstance(entity, KiwiOsTimestampSensorEntity)
+        for entity in parser.get_entities()
+    )
+    value_sensor = value_sensors[POWER_OUT]
+    assert value_sensor.timestamp is None
+    assert value_sensor.extra_state_attributes is None
+    # The device timestamps are still tracked for the freshness diagnostics.
+    assert POWER_OUT in parser.item_timestamps_ms
@@ -0,0 +1,64 @@
+"""Test aligning polls to the update cadence of the box."""
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_schedule import (
+    MIN_DELAY,
+    KiwiOsPollAligner,
+)
+
+START_MS = 1760711100000
+LAG = 3.0  # seconds until values of a grid point are visible
+
+
+def _simulate(period: float, interval: float, polls: int) -> list[float]:
+    """Poll a box updating every period seconds, return the poll times."""
+    aligner = KiwiOsPollAligner(interval=interval)
+    now = START_MS / 1000 + 1.0
+    times = []
+    for _ in range(polls):
+        times.append(now)
+        # The newest grid point visible at this time.
+        grid_ms = int((now - LAG - START_MS / 1000) // period * period * 1000)
+        if grid_ms >= 0:
+            aligner.observe([START_MS + grid_ms], now)
+        delay = aligner.next_delay(now)
+        now += delay if delay is not None else interval
+    return times
+
+
+def test_learn_period():
+    """Test that the period is the gcd of the distinct timestamps."""
+    aligner = KiwiOsPollAligner(interval=60)
+    aligner.observe([START_MS, START_MS + 30000], START_MS / 1000 + 40)
+    assert aligner.period_ms is None
+    assert aligner.next_delay(START_MS / 1000 + 40) is None
+    aligner.observe([START_MS + 45000, START_MS + 75000], START_MS / 1000 + 80)
+    assert aligner.period_ms == 15000
+
+
+def test_fast_box():
+    """Test that every k-th update is fetched at most interval seconds apart."""
+    times = _simulate(period=15, interval=50, polls=30)
+    gaps = [current - previous for previous, current in zip(times, times[1:])]
+    # Once the period is learned, every third update is fetched.
+    assert gaps[-10:] == [45] * 10
+    phases = {round((time - START_MS / 1000) % 15, 6) for time in times[-10:]}
+    assert len(phases) == 1
+
+
+def test_slow_box():
+    """Test that a box slower than the interval is still polled every interval."""
+    times = _simulate(period=300, interval=60, polls=50)
+    gaps = [current - previous for previous, current in zip(times, times[1:])]
+    assert max(gaps) <= 60
+    assert min(gaps) >= MIN_DELAY
+
+
+def test_min_delay():
+    """Test that polls are never scheduled closer than MIN_DELAY."""
+    aligner = KiwiOsPollAligner(interval=60)
+    for step in range(4):
+        aligner.observe([START_MS + step * 10000], START_MS / 1000 + step * 10 + 1)
+    now = START_MS / 1000 + 40 + 2
+    delay = aligner.next_delay(now)
+    assert delay is not None
+    assert MIN_DELAY <= delay <= 60
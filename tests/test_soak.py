@@ -0,0 +1,128 @@
+"""Soak test that memory stays flat over many polls.
+
+KIWIOS_SOAK_POLLS sets the number of polls to simulate, a small number by
+default and e.g. KIWIOS_SOAK_POLLS=200000 for a long run. A hundredth of them
+also go through the API client and a local stand-in box.
+"""
+
+from collections.abc import Awaitable, Callable
+import gc
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_api import KiwiOsApi
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_budget import (
+    KiwiOsRequestBudget,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_feed import (
+    KiwiOsSnapshotFeed,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_freshness import (
+    KiwiOsFreshnessTracker,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_memory import (
+    KiwiOsMemoryProfiler,
+    take_snapshot,
+    top_sites,
+)
+from custom_components.ampere_iq_smartbox_homeassistant.kiwi_os_parser import (
+    KiwiOsParser,
+)
+
+DATA = Path(__file__).parent.parent / "test_data"
+POLLS = int(os.environ.get("KIWIOS_SOAK_POLLS", "500"))
+WARMUP_POLLS = 1000
+MAX_GROWTH = 64 * 1024  # bytes
+
+
+class _Box:
+    """Simulated box whose harmonized items advance by one second per poll."""
+
+    def __init__(self) -> None:
+        self.things = json.loads((DATA / "things.json").read_text())
+        self.items = json.loads((DATA / "items.json").read_text())
+        self.poll = 0
+
+    def next_items(self) -> list[dict[str, Any]]:
+        self.poll += 1
+        items = []
+        for item in self.items:
+            state = item["state"]
+            if "|" in state:
+                timestamp_ms, value = state.split("|", 1)
+                state = f"{int(timestamp_ms) + self.poll * 1000}|{value}"
+            items.append({**item, "state": state})
+        return items
+
+
+def _create_parser(box: _Box) -> tuple[KiwiOsParser, Callable[[Any], None]]:
+    parser = KiwiOsParser()
+    parser.parse_things(box.things, None)
+    items = parser.map_json_items(box.items)
+    parser.create_entities(items)
+    parser.guess_item_types(items)
+    freshness = KiwiOsFreshnessTracker()
+    feed = KiwiOsSnapshotFeed()
+    feed.subscribe(lambda delta, polled_at: None)
+
+    def parse(json_items: Any) -> None:
+        # Same steps as the coordinator update of the integration.
+        parser.parse_item_values(parser.map_json_items(json_items))
+        polled_at = box.poll * 1.0
+        freshness.record(parser.item_timestamps_ms, polled_at)
+        feed.publish(polled_at, parser.iter_values())
+
+    return parser, parse
+
+
+async def _assert_flat(polls: int, poll: Callable[[], Awaitable[None]]) -> None:
+    for _ in range(WARMUP_POLLS):
+        await poll()
+    with KiwiOsMemoryProfiler().profile():
+        gc.collect()
+        baseline = take_snapshot()
+        for _ in range(polls):
+            await poll()
+        gc.collect()
+        snapshot = take_snapshot()
+    growth = sum(stat.size_diff for stat in snapshot.compare_to(baseline, "filename"))
+    assert growth < MAX_GROWTH, top_sites(snapshot, baseline)
+
+
+async def test_parser_soak():
+    """Test that parsing many polls does not grow memory."""
+    box = _Box()
+    _, parse = _create_parser(box)
+
+    async def poll() -> None:
+        parse(box.next_items())
+
+    await _assert_flat(POLLS, poll)
+
+
+async def test_api_soak(stand_in_box):
+    """Test that fetching and parsing many polls does not grow memory."""
+    box = _Box()
+    _, parse = _create_parser(box)
+
+    async def get_items(request: web.Request) -> web.Response:
+        return web.json_response(box.next_items())
+
+    host = await stand_in_box({"/rest/items": get_items})
+    async with aiohttp.ClientSession() as session:
+        api = KiwiOsApi(
+            url=URL(f"http://{host}"),
+            session=session,
+            budget=KiwiOsRequestBudget(max_rate=1e6, max_concurrency=1),
+        )
+
+        async def poll() -> None:
+            parse(await api.get_items())
+
+        await _assert_flat(max(POLLS // 100, 1), poll)
@@ -0,0 +1,71 @@
+"""Test the snapshot feed websocket API against a local stand-in box."""
+
+from aiohttp import web
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.ampere_iq_smartbox_homeassistant.const import DOMAIN
+
+
+async def test_subscribe(hass, hass_ws_client, stand_in_box, things, items):
+    """Test that subscribers get the full snapshot, then only changed values."""
+
+    async def get_things(request):
+        return web.json_response(things)
+
+    async def get_items(request):
+        return web.json_response(items)
+
+    host = await stand_in_box({"/rest/things": get_things, "/rest/items": get_items})
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={"url": f"http://{host}", "password": ""},
+        options={"align_polls": False, "channel_policy": "cloud_mapped"},
+        title="Box",
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+
+    client = await hass_ws_client(hass)
+    await client.send_json_auto_id(
+        {"type": f"{DOMAIN}/subscribe", "config_entry_id": entry.entry_id}
+    )
+    assert (await client.receive_json())["success"]
+    snapshot = (await client.receive_json())["event"]
+    assert snapshot["type"] == "snapshot"
+    assert len(snapshot["values"]) == 48
+
+    item = next(
+        item
+        for item in items
+        if item["name"] in snapshot["values"] and "|" in item["state"]
+    )
+    item_name = item["name"]
+    value = snapshot["values"][item_name]
+    timestamp_ms, state = item["state"].split("|")
+    item["state"] = f"{int(timestamp_ms) + 1000}|{state}"
+    await entry.runtime_data.coordinator.async_refresh()
+
+    delta = (await client.receive_json())["event"]
+    assert delta["type"] == "delta"
+    assert delta["values"] == {
+        item_name: {**value, "timestamp": int(timestamp_ms) + 1000}
+    }
+
+    # The subscription follows the entry when it is reloaded with new options.
+    hass.config_entries.async_update_entry(
+        entry, options={**entry.options, "channel_policy": "all"}
+    )
+    await hass.async_block_till_done()
+    assert (await client.receive_json())["event"] == {"type": "unloaded"}
+    snapshot = (await client.receive_json())["event"]
+    assert snapshot["type"] == "snapshot"
+    assert len(snapshot["values"]) == 99
+
+    item["state"] = f"{int(timestamp_ms) + 2000}|{state}"
+    await entry.runtime_data.coordinator.async_refresh()
+    delta = (await client.receive_json())["event"]
+    assert delta["type"] == "delta"
+    assert list(delta["values"]) == [item_name]
+
+    assert await hass.config_entries.async_unload(entry.entry_id)